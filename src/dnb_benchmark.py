@@ -0,0 +1,290 @@
+#! /usr/bin/env python3
+
+import argparse
+import contextlib
+import csv
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import dnb_generator
+import dnb_mapper
+
+
+# ----------------------------------------
+def makeAddress(i):
+    return {
+        "streetAddress": {"line1": "%s Main Street" % (100 + i), "line2": "Suite %s" % i},
+        "addressLocality": {"name": "Springfield"},
+        "addressRegion": {"abbreviatedName": "IL"},
+        "postalCode": "6270%s" % (i % 10),
+        "addressCountry": {"isoAlpha2Code": "US"},
+    }
+
+
+# ----------------------------------------
+def makeOrganization(principalCount):
+    """a CMPCVF row for one organization with this many current principals, the most senior of them listed twice"""
+    principalList = []
+    for i in range(principalCount):
+        principalList.append(
+            {
+                "givenName": "Given%s" % i,
+                "familyName": "Family%s" % i,
+                "birthDate": "1970-01-%02d" % (i % 28 + 1),
+                "primaryAddress": makeAddress(i),
+                "jobTitles": [{"title": "Director"}],
+                "subjectType": "Individual",
+            }
+        )
+    parentData = {"duns": "987654321", "primaryName": "Parent Holdings", "primaryAddress": makeAddress(0)}
+    return {
+        "organization": {
+            "duns": "123456789",
+            "primaryName": "Big Company",
+            "primaryAddress": makeAddress(1),
+            "corporateLinkage": {
+                "globalUltimate": parentData,
+                "domesticUltimate": parentData,
+                "parent": parentData,
+                "headquarter": parentData,
+            },
+            "mostSeniorPrincipals": principalList[:5],
+            "currentPrincipals": principalList,
+        }
+    }
+
+
+# ----------------------------------------
+def bestTime(benchmarkFunction, repeatCount):
+    """best wall clock seconds of repeated calls, the least disturbed by everything else running"""
+    bestSeconds = None
+    for _ in range(repeatCount):
+        startTime = time.perf_counter()
+        benchmarkFunction()
+        elapsedSeconds = time.perf_counter() - startTime
+        if bestSeconds is None or elapsedSeconds < bestSeconds:
+            bestSeconds = elapsedSeconds
+    return bestSeconds
+
+
+# ----------------------------------------
+def listScanDedupe(recordList):
+    """how format_CMPCVF used to de-dupe, comparing each record to every one kept so far"""
+    jsonList = []
+    for jsonData in recordList:
+        if jsonData not in jsonList:
+            jsonList.append(jsonData)
+    return jsonList
+
+
+# ----------------------------------------
+def keyedDedupe(recordList):
+    jsonList = []
+    jsonKeys = set()
+    for jsonData in recordList:
+        jsonKey = dnb_mapper.getRecordKey(jsonData)
+        if jsonKey not in jsonKeys:
+            jsonKeys.add(jsonKey)
+            jsonList.append(jsonData)
+    return jsonList
+
+
+# ----------------------------------------
+def benchmarkPrincipalDedupe(principalCounts, repeatCount):
+    print("\nformat_CMPCVF principle de-dupe\n")
+    print("%12s %16s %16s %16s %10s" % ("principles", "format_CMPCVF ms", "list scan ms", "keyed ms", "speedup"))
+    for principalCount in principalCounts:
+        rowData = makeOrganization(principalCount)
+        recordList = dnb_mapper.format_CMPCVF(rowData)[:-1]
+        if listScanDedupe(recordList) != keyedDedupe(recordList):
+            print("\nThe keyed de-dupe does not match the list scan!\n")
+            return 1
+
+        formatSeconds = bestTime(functools.partial(dnb_mapper.format_CMPCVF, rowData), repeatCount)
+        listScanSeconds = bestTime(functools.partial(listScanDedupe, recordList), repeatCount)
+        keyedSeconds = bestTime(functools.partial(keyedDedupe, recordList), repeatCount)
+        print(
+            "%12s %16.2f %16.2f %16.2f %9.1fx"
+            % (
+                principalCount,
+                formatSeconds * 1000,
+                listScanSeconds * 1000,
+                keyedSeconds * 1000,
+                listScanSeconds / keyedSeconds,
+            )
+        )
+    return 0
+
+
+# ----------------------------------------
+def setUpMapper(dnbFormat, jsonBackend):
+    """the globals the mapper's main sets up before it maps any files"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dnb_formats.json"), "r") as formatFileHandle:
+        dnb_mapper.dnbFormats = json.load(formatFileHandle)
+    dnb_mapper.dnbFormat = dnbFormat
+    dnb_mapper.setJsonBackend(jsonBackend, False)
+    dnb_mapper.setStatsLevel("full")
+    dnb_mapper.resetStats()
+    dnb_mapper.setParentCache(10000)
+    dnb_mapper.ubo_company_cache = {"subject": dnb_mapper.DunsIndex(), "parent": dnb_mapper.DunsIndex()}
+    dnb_mapper.ubo_depth_cache = {}
+    dnb_mapper.parentDunsIndex = None
+    dnb_mapper.byteRange = None
+    dnb_mapper.workerCount = 1
+    dnb_mapper.stopEvent = None
+    dnb_mapper.shutDown = False
+    dnb_mapper.inputFileNum = 1
+    dnb_mapper.procStartTime = time.time()
+    dnb_mapper.progressInterval = 10**12
+
+
+# ----------------------------------------
+def readRows(dnbFormat, inputFileName):
+    """the parsed rows of a generated file, ready for the format's mapping function"""
+    schemaData = dnb_mapper.dnbFormats["schemas"][dnb_mapper.dnbFormats["mappings"][dnbFormat]["inputSchema"]]
+    with open(inputFileName, "r", encoding=schemaData.get("encoding")) as inputFileHandle:
+        if schemaData["fileType"].upper() == "JSON":
+            return [dnb_mapper.jsonLoads(row) for row in inputFileHandle]
+        inputFileReader = csv.reader(inputFileHandle, delimiter="\t")
+        schemaData = dict(schemaData, columns=next(inputFileReader))
+        dnb_mapper.schemaData = dnb_mapper.compileSchema(schemaData)
+        dnb_mapper.setRecordMapper()
+        if dnb_mapper.recordMapper is not None:
+            return list(inputFileReader)
+        return [dict(zip(dnb_mapper.schemaData["columnNames"], row)) for row in inputFileReader]
+
+
+# ----------------------------------------
+def mapUboAlone(rowData):
+    jsonList, dnb_mapper.ubo_company_cache = dnb_mapper.format_UBO_SUBJECT(rowData, dnb_mapper.ubo_company_cache)
+    ownerList, dnb_mapper.ubo_depth_cache = dnb_mapper.format_UBO2(rowData, dnb_mapper.ubo_depth_cache)
+    return jsonList + ownerList
+
+
+# ----------------------------------------
+def runPipelineCase(dnbFormat, stageName, inputFileName, jsonBackend):
+    """time one stage in a process of its own so the peak memory is just this stage's, returns
+    the seconds taken, rows mapped and peak RSS in bytes"""
+    setUpMapper(dnbFormat, jsonBackend)
+    if stageName == "mapping":
+        rowList = readRows(dnbFormat, inputFileName)
+        if dnbFormat == "CMPCVF":
+            mapFunction = dnb_mapper.format_CMPCVF
+        elif dnbFormat == "UBO_ALONE":
+            mapFunction = mapUboAlone
+        else:
+            mapFunction = dnb_mapper.recordMapper
+        startTime = time.perf_counter()
+        for rowData in rowList:
+            mapFunction(rowData)
+        elapsedSeconds = time.perf_counter() - startTime
+        rowCount = len(rowList)
+    else:
+        # --a file on the null device stands in for the loader so only the mapper is timed
+        dnb_mapper.outputIsFile = True
+        dnb_mapper.outputFileName = os.devnull
+        dnb_mapper.outputSink = dnb_mapper.FileSink(os.devnull, 1000)
+        startTime = time.perf_counter()
+        with contextlib.redirect_stdout(None):
+            dnb_mapper.processFile(inputFileName)
+            dnb_mapper.outputSink.close()
+        elapsedSeconds = time.perf_counter() - startTime
+        rowCount = dnb_mapper.statPack["INPUT"]["ROW_COUNT"]["count"]
+
+    # --linux reports the peak in kilobytes and macos in bytes
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsedSeconds, rowCount, peakRss if sys.platform == "darwin" else peakRss * 1024
+
+
+# ----------------------------------------
+def benchmarkPipeline(rowCount, seed, repeatCount, jsonBackend):
+    print("\nmapping functions and the whole processFile pipeline on %s generated rows\n" % rowCount)
+    print("%10s %12s %10s %12s %10s %14s" % ("format", "stage", "rows", "rows/sec", "MB/sec", "peak RSS MB"))
+    spawnContext = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="dnb_benchmark_") as tempDirectory:
+        for dnbFormat in ("CMPCVF", "GCA", "UBO", "UBO_ALONE"):
+            inputFormat = "UBO" if dnbFormat == "UBO_ALONE" else dnbFormat
+            inputFileName = os.path.join(tempDirectory, inputFormat + ".txt")
+            if not os.path.exists(inputFileName):
+                dnb_generator.generateFile(inputFormat, inputFileName, rowCount, seed)
+            fileMegabytes = os.path.getsize(inputFileName) / 1048576
+
+            for stageName in ("mapping", "processFile"):
+                caseResults = []
+                for _ in range(repeatCount):
+                    with spawnContext.Pool(1) as pool:
+                        caseResults.append(
+                            pool.apply(runPipelineCase, (dnbFormat, stageName, inputFileName, jsonBackend))
+                        )
+                elapsedSeconds, mappedRows, peakRss = min(caseResults)
+                print(
+                    "%10s %12s %10s %12.0f %10.2f %14.1f"
+                    % (
+                        dnbFormat,
+                        stageName,
+                        mappedRows,
+                        mappedRows / elapsedSeconds,
+                        fileMegabytes / elapsedSeconds,
+                        peakRss / 1048576,
+                    )
+                )
+    return 0
+
+
+# ----------------------------------------
+if __name__ == "__main__":
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        "-r",
+        "--repeat",
+        default=5,
+        type=int,
+        help="number of times to run each case, the best time is reported",
+    )
+    argparser.add_argument(
+        "-s",
+        "--suite",
+        default="all",
+        type=str.lower,
+        choices=["all", "dedupe", "pipeline"],
+        help="the principle de-dupe, the mapping pipeline or all benchmarks, defaults to all",
+    )
+    argparser.add_argument(
+        "--rows",
+        default=10000,
+        type=int,
+        help="number of rows to generate for each format in the pipeline benchmark, defaults to 10000",
+    )
+    argparser.add_argument(
+        "--seed",
+        default=1,
+        type=int,
+        help="random seed for the generated rows",
+    )
+    argparser.add_argument(
+        "--json_backend",
+        default="auto",
+        type=str.lower,
+        choices=["auto", "orjson", "ujson", "json"],
+        help="json library for the pipeline benchmark to parse and write with",
+    )
+    args = argparser.parse_args()
+
+    # --the mapper's globals are normally set up by its main
+    dnb_mapper.setJsonBackend("auto", False)
+    dnb_mapper.setStatsLevel("full")
+    dnb_mapper.resetStats()
+
+    exitCode = 0
+    if args.suite in ("all", "dedupe"):
+        exitCode = benchmarkPrincipalDedupe([10, 50, 100, 250, 500], args.repeat)
+    if args.suite in ("all", "pipeline") and not exitCode:
+        exitCode = benchmarkPipeline(args.rows, args.seed, args.repeat, args.json_backend)
+    sys.exit(exitCode)
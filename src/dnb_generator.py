@@ -0,0 +1,270 @@
+#! /usr/bin/env python3
+
+import argparse
+import json
+import os
+import random
+import sys
+
+# --the made up values are drawn from these so the data has the repetition real files have
+givenNames = ["John", "Mary", "José", "Anna", "Wei", "Fatima", "Jürgen", "Olga", "Pierre", "Aiko"]
+familyNames = ["Smith", "García", "Müller", "Chen", "Okafor", "Ivanova", "Dubois", "Tanaka", "Rossi", "Nowak"]
+jobTitles = ["Chief Executive Officer", "President", "Director", "Secretary", "Treasurer", "Manager"]
+companyWords = ["Global", "Acme", "Northern", "Pacific", "Summit", "Union", "Atlas", "Pioneer", "Crown", "Delta"]
+companySuffixes = ["Inc", "LLC", "Ltd", "GmbH", "S.A.", "Holdings", "Group", "Corp"]
+streetNames = ["Main", "Oak", "High", "Market", "Church", "Station", "Mill", "Park"]
+cityList = [
+    ("Austin", "TX", "US"),
+    ("Boston", "MA", "US"),
+    ("Köln", "NW", "DE"),
+    ("Lyon", "", "FR"),
+    ("Leeds", "", "GB"),
+]
+
+
+# ----------------------------------------
+def makeDuns(randomGen):
+    return "%09d" % randomGen.randint(10**8, 10**9 - 1)
+
+
+# ----------------------------------------
+def makeCompanyName(randomGen):
+    return "%s %s %s" % (
+        randomGen.choice(companyWords),
+        randomGen.choice(companyWords),
+        randomGen.choice(companySuffixes),
+    )
+
+
+# ----------------------------------------
+def makeAddress(randomGen):
+    cityName, regionCode, countryCode = randomGen.choice(cityList)
+    return {
+        "streetAddress": {
+            "line1": "%s %s Street" % (randomGen.randint(1, 9999), randomGen.choice(streetNames)),
+            "line2": randomGen.choice([None, "", "Suite %s" % randomGen.randint(1, 900)]),
+        },
+        "addressLocality": {"name": cityName},
+        "addressRegion": {"abbreviatedName": regionCode or None},
+        "postalCode": "%05d" % randomGen.randint(1000, 99999),
+        "addressCountry": {"isoAlpha2Code": countryCode},
+    }
+
+
+# ----------------------------------------
+def makePrincipal(randomGen):
+    principalData = {
+        "givenName": randomGen.choice(givenNames),
+        "familyName": randomGen.choice(familyNames),
+        "jobTitles": [{"title": randomGen.choice(jobTitles)}],
+        "subjectType": "Individual",
+    }
+    if randomGen.random() < 0.3:
+        principalData["birthDate"] = "19%02d-%02d-%02d" % (
+            randomGen.randint(40, 99),
+            randomGen.randint(1, 12),
+            randomGen.randint(1, 28),
+        )
+    if randomGen.random() < 0.5:
+        principalData["primaryAddress"] = makeAddress(randomGen)
+    return principalData
+
+
+# ----------------------------------------
+def makeOrganization(randomGen, parentList):
+    """a CMPCVF row, most companies belong to one of the parent families and some have long principal lists"""
+    linkageData = {}
+    if parentList and randomGen.random() < 0.8:
+        globalUltimate = randomGen.choice(parentList)
+        parentData = randomGen.choice([globalUltimate, randomGen.choice(parentList)])
+        linkageData = {
+            "globalUltimate": globalUltimate,
+            "domesticUltimate": randomGen.choice([globalUltimate, parentData]),
+            "parent": parentData,
+            "headquarter": randomGen.choice([{}, parentData]),
+        }
+
+    principalCount = randomGen.choice([0, 1, 2, 3, 5, 8]) if randomGen.random() < 0.98 else randomGen.randint(20, 200)
+    principalList = [makePrincipal(randomGen) for _ in range(principalCount)]
+    organizationData = {
+        "duns": makeDuns(randomGen),
+        "primaryName": makeCompanyName(randomGen),
+        "tradeStyleNames": [{"name": makeCompanyName(randomGen)}] if randomGen.random() < 0.2 else [],
+        "primaryAddress": makeAddress(randomGen),
+        "telephone": [{"telephoneNumber": "%07d" % randomGen.randint(0, 9999999), "isdCode": "1"}],
+        "registrationNumbers": [
+            {
+                "typeDescription": "Federal Taxpayer Identification Number (US)",
+                "registrationNumber": "%09d" % randomGen.randint(0, 10**9 - 1),
+            }
+        ],
+        "industryCodes": [
+            {
+                "code": str(randomGen.randint(1000, 9999)),
+                "description": "Industry",
+                "typeDescription": "US Standard Industry Code 1987 - 4 digit",
+            }
+        ],
+        "dunsControlStatus": {"operatingStatus": {"description": randomGen.choice(["Active", "Out of Business"])}},
+        "corporateLinkage": linkageData,
+        "mostSeniorPrincipals": principalList[:2],
+        "currentPrincipals": principalList,
+    }
+    return {"organization": organizationData}
+
+
+# ----------------------------------------
+def makeParentList(randomGen, parentCount):
+    return [
+        {
+            "duns": makeDuns(randomGen),
+            "primaryName": makeCompanyName(randomGen),
+            "primaryAddress": makeAddress(randomGen),
+        }
+        for _ in range(parentCount)
+    ]
+
+
+# ----------------------------------------
+def generateCMPCVF(outputFileHandle, rowCount, randomGen):
+    parentList = makeParentList(randomGen, max(rowCount // 100, 1))
+    for _ in range(rowCount):
+        outputFileHandle.write(json.dumps(makeOrganization(randomGen, parentList), ensure_ascii=False) + "\n")
+
+
+# ----------------------------------------
+def generateGCA(outputFileHandle, rowCount, randomGen, columnList):
+    outputFileHandle.write("\t".join(columnList) + "\n")
+    companyList = [(makeDuns(randomGen), makeCompanyName(randomGen)) for _ in range(max(rowCount // 20, 1))]
+    for rowNum in range(rowCount):
+        cityName, regionCode, countryCode = randomGen.choice(cityList)
+        companyDuns, companyName = randomGen.choice(companyList)
+        givenName, familyName = randomGen.choice(givenNames), randomGen.choice(familyNames)
+        rowData = {
+            "ROWNUM": str(rowNum),
+            "CONTACT_ID": str(rowNum + 1),
+            "INDIVIDUAL_ID": str(randomGen.randint(1, 10**9)),
+            "FIRSTNAME": givenName,
+            "LASTNAME": familyName,
+            "MIDDLENAME": randomGen.choice(["", "", "A", "J"]),
+            "EMAIL": "%s.%s@example.com" % (givenName.lower(), familyName.lower()) if randomGen.random() < 0.7 else "",
+            "PRIMARYPHONE": "%010d" % randomGen.randint(0, 10**10 - 1),
+            "JOBTITLE": randomGen.choice(jobTitles),
+            "GCA_STREETADDRESS1": "%s %s Street" % (randomGen.randint(1, 9999), randomGen.choice(streetNames)),
+            "GCA_CITYNAME": cityName,
+            "GCA_STATEPROVINCECODE": regionCode,
+            "GCA_POSTALCODE": "%05d" % randomGen.randint(1000, 99999),
+            "GCA_COUNTRYCODE": countryCode,
+            "GCA_GENDER": randomGen.choice(["M", "F", ""]),
+            "GCA_BUSINESSNAME": companyName,
+            "DUNS_ID": companyDuns,
+            "DUNS": companyDuns,
+        }
+        outputFileHandle.write("\t".join([rowData.get(columnName, "") for columnName in columnList]) + "\n")
+
+
+# ----------------------------------------
+def makeBeneficiary(randomGen):
+    if randomGen.random() < 0.6:
+        cityName, regionCode, countryCode = randomGen.choice(cityList)
+        return {
+            "BENF_NME": "%s %s" % (randomGen.choice(givenNames), randomGen.choice(familyNames)),
+            "BENF_TYP_CD": "119",
+            "BENF_TYP_DESC": "Individual",
+            "BENF_PRIM_TOWN": cityName,
+            "BENF_PROV_OR_ST": regionCode,
+            "BENF_CTRY_CD": countryCode,
+        }
+    return {
+        "BENF_NME": makeCompanyName(randomGen),
+        "BENF_DUNS": makeDuns(randomGen),
+        "BENF_TYP_CD": "120",
+        "BENF_TYP_DESC": "Business",
+        "BENF_ADR_LN1": "%s %s Street" % (randomGen.randint(1, 9999), randomGen.choice(streetNames)),
+    }
+
+
+# ----------------------------------------
+def generateUBO(outputFileHandle, rowCount, randomGen, columnList):
+    """each subject has owners up to four levels deep, their rows together and in depth order as DNB sends them"""
+    outputFileHandle.write("\t".join(columnList) + "\n")
+    parentList = makeParentList(randomGen, max(rowCount // 200, 1))
+    rowNum = 0
+    while rowNum < rowCount:
+        parentData = randomGen.choice(parentList)
+        subjectData = {
+            "SUBJ_DUNS": makeDuns(randomGen),
+            "SUBJ_NME": makeCompanyName(randomGen),
+            "SUBJ_ADR_LN1": "%s %s Street" % (randomGen.randint(1, 9999), randomGen.choice(streetNames)),
+            "SUBJ_PRIM_TOWN": randomGen.choice(cityList)[0],
+            "SUBJ_CTRY_CD": randomGen.choice(cityList)[2],
+            "PRNT_DUNS": parentData["duns"],
+            "PRNT_NME": parentData["primaryName"],
+            "GLBL_ULT_DUNS": parentData["duns"],
+            "GLBL_ULT_NME": parentData["primaryName"],
+        }
+        for depth in range(1, randomGen.choice([1, 1, 2, 2, 3, 4]) + 1):
+            for _ in range(randomGen.randint(1, 3)):
+                if rowNum == rowCount:
+                    return
+                rowNum += 1
+                rowData = dict(subjectData, **makeBeneficiary(randomGen))
+                rowData["BENF_ID"] = str(rowNum)
+                rowData["DEPTH"] = str(depth)
+                rowData["DIRC_OWRP_PCTG"] = str(randomGen.choice([10, 25, 50, 100])) if depth == 1 else ""
+                rowData["IDIR_OWRP_PCTG"] = str(randomGen.choice([5, 12.5, 25])) if depth > 1 else ""
+                rowData["BENF_OWRP_PCTG"] = str(randomGen.choice([10, 25, 50]))
+                outputFileHandle.write("\t".join([rowData.get(columnName, "") for columnName in columnList]) + "\n")
+
+
+# ----------------------------------------
+def generateFile(dnbFormat, outputFileName, rowCount, seed=1):
+    """write rowCount rows of made up DNB data in one of its input formats, the same seed always writes the same file"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dnb_formats.json"), "r") as formatFileHandle:
+        dnbFormats = json.load(formatFileHandle)
+    inputSchema = dnbFormats["schemas"][dnbFormats["mappings"][dnbFormat]["inputSchema"]]
+    randomGen = random.Random(seed)
+    with open(outputFileName, "w", encoding=inputSchema.get("encoding", "utf-8")) as outputFileHandle:
+        if dnbFormat == "CMPCVF":
+            generateCMPCVF(outputFileHandle, rowCount, randomGen)
+        elif dnbFormat == "GCA":
+            generateGCA(outputFileHandle, rowCount, randomGen, inputSchema["columns"])
+        else:
+            generateUBO(outputFileHandle, rowCount, randomGen, inputSchema["columns"])
+    return os.path.getsize(outputFileName)
+
+
+# ----------------------------------------
+if __name__ == "__main__":
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        "-f",
+        "--dnb_format",
+        type=str.upper,
+        choices=["CMPCVF", "GCA", "UBO"],
+        help="the DNB format to make up rows for",
+    )
+    argparser.add_argument("-o", "--output_file", type=str, help="file to write the rows to")
+    argparser.add_argument(
+        "-r",
+        "--rows",
+        default=10000,
+        type=int,
+        help="number of rows to write, defaults to 10000",
+    )
+    argparser.add_argument(
+        "--seed",
+        default=1,
+        type=int,
+        help="random seed, the same seed and row count always make the same file",
+    )
+    args = argparser.parse_args()
+
+    if not args.dnb_format or not args.output_file:
+        print("\nPlease enter a DNB format and an output file\n")
+        sys.exit(1)
+
+    fileSize = generateFile(args.dnb_format, args.output_file, args.rows, args.seed)
+    print(f"{args.rows} {args.dnb_format} rows written to {args.output_file}, {fileSize / 1048576:.1f} MB")
+    sys.exit(0)
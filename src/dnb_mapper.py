@@ -1,44 +1,157 @@
 #! /usr/bin/env python3
 
+import abc
 import argparse
+import array
+import bisect
+import bz2
+import codecs
+import collections
+import cProfile
 import csv
+import functools
 import glob
+import gzip
+import hashlib
+import heapq
+import importlib
+import importlib.util
+import io
+import itertools
 import json
+import locale
+import lzma
+import math
+import mmap
+import multiprocessing
+import operator
 import os
+import pstats
+import queue
 import random
+import re
+import shutil
 import signal
 import sys
+import tempfile
+import threading
 import time
 from datetime import datetime, timedelta
 
+# --the globals copied into worker processes so they map exactly like the main one
+workerSettingNames = [
+    "dnbFormat",
+    "dnbFormats",
+    "schemaData",
+    "delimiter",
+    "outputIsFile",
+    "outputFilePath",
+    "progressInterval",
+    "procStartTime",
+    "workerBatchSize",
+    "byteRange",
+    "jsonBackend",
+    "compactJson",
+    "outputCompression",
+    "outputBatchSize",
+    "outputShards",
+    "timingSampleRate",
+    "statsLevel",
+    "parentCacheSize",
+    "uboStreaming",
+    "uboSort",
+    "sortMemoryMb",
+    "sortTempDir",
+    "previousIndexFile",
+    "deltaRunDirectory",
+]
+
+# --compressed input files are read without decompressing them to disk first
+compressionExtensions = {".gz": "gzip", ".gzip": "gzip", ".bz2": "bz2", ".xz": "xz", ".lzma": "xz"}
+compressionMagicBytes = {b"\x1f\x8b": "gzip", b"BZh": "bz2", b"\xfd7zXZ\x00": "xz"}
+outputCompressionExtensions = {"gzip": ".gz", "xz": ".xz"}
+
+# --bytes of mapped records buffered by each output file before they are written out
+outputBufferSize = 1048576
+
+# --bytes of a mapped json lines file split at a time to index its lines
+mappedChunkSize = 8388608
+
+# --one bit for each possible 9 digit DUNS number
+dunsBitmapSize = 10**9 // 8
+
+# --records of these data sources that were in the previous run but not this one are deleted
+deleteDataSources = ("DNB-COMPANY", "DNB-PRINCIPLE", "DNB-OWNER", "DNB-CONTACT")
+
+# --the ubo subjects and parents already mapped, set up for the whole run in main
+ubo_company_cache = {}
+uboStreaming = False
+uboSort = False
+sortMemoryMb = 1024
+sortTempDir = None
+uboFinishedSubjects = None
+uboNotGrouped = False
+checkpointFile = None
+resumeState = None
+outputSink = None
+outputBatchSize = 1000
+outputCompression = None
+outputShards = 1
+timingSampleRate = 0
+metricsFile = None
+metricsFormat = "prometheus"
+metricsSeconds = 15
+nextMetricsTime = 0
+recordsWritten = collections.defaultdict(int)
+runProgress = {"rowsRead": 0, "badRows": 0, "bytesRead": 0, "bytesSkipped": 0, "bytesTotal": 0, "fileCount": 0}
+
 
 # ----------------------------------------
 def processFile(inputFileName):
-    updateStat("INPUT", "FILE_COUNT")
-    global shutDown, outputFileHandle, outputFileName
+    global shutDown, outputSink, outputFileName, schemaData, delimiter
+    global ubo_depth_cache, uboFinishedSubjects, resumeState
+
+    # --a resumed file picks up after the last row in its checkpoint
+    resumeRowCnt = resumeState["rowCnt"] if resumeState else 0
+    if not resumeState:
+        updateStat("INPUT", "FILE_COUNT")
+
+    if dnbFormat not in ("CMPCVF", "UBO_ALONE") and "recordMap" not in dnbFormats["mappings"][dnbFormat]:
+        print("")
+        print("No conversions for format code %s" % dnbFormat)
+        print("")
+        return True
 
     # --set up a reader
     schemaData = dnbFormats["schemas"][dnbFormats["mappings"][dnbFormat]["inputSchema"]]
+    delimiter = None
 
+    # --json lines are handed to the parser as bytes, uncompressed ones straight out of a memory map
+    isJson = schemaData["fileType"].upper() == "JSON"
     try:
-        if "encoding" in schemaData:
-            inputFileHandle = open(inputFileName, "r", encoding=schemaData["encoding"])
+        if isJson and (byteRange or not getCompression(inputFileName)):
+            inputFileHandle = MappedLines(inputFileName, schemaData.get("encoding", locale.getpreferredencoding(False)))
         else:
-            inputFileHandle = open(inputFileName, "r")
+            inputFileHandle = openInputFile(inputFileName, schemaData.get("encoding"), binary=isJson)
     except IOError as err:
         print("")
         print(err)
         print("")
         return 1
 
-    if schemaData["fileType"].upper() == "JSON":
-        inputFileReader = inputFileHandle
+    if isinstance(inputFileHandle, MappedLines):
+        inputFileReader = inputFileHandle.iterLines(*(byteRange or (0, None)), skipLines=resumeRowCnt)
+    elif isJson:
+        inputEncoding = schemaData.get("encoding", locale.getpreferredencoding(False))
+        inputFileReader = readBinaryLines(inputFileHandle, inputEncoding)
     else:
 
-        # --set csv dialect
+        # --set csv dialect, compressed files cannot seek back so the first line is put back in front instead
+        inputLines = inputFileHandle
         if schemaData["fileType"].upper() == "CHECK":
-            sniffer = csv.Sniffer().sniff(inputFileHandle.readline(), delimiters="|,\t")
-            inputFileHandle.seek(0)
+            firstLine = inputFileHandle.readline()
+            sniffer = csv.Sniffer().sniff(firstLine, delimiters="|,\t")
+            inputLines = itertools.chain([firstLine], inputFileHandle)
             delimiter = sniffer.delimiter
         elif schemaData["fileType"].upper() == "TAB":
             delimiter = "\t"
@@ -58,10 +171,10 @@ def processFile(inputFileName):
         try:
             if quotechar:
                 inputFileReader = csv.reader(
-                    inputFileHandle, delimiter=delimiter, quotechar=quotechar
+                    inputLines, delimiter=delimiter, quotechar=quotechar
                 )
             else:
-                inputFileReader = csv.reader(inputFileHandle, delimiter=delimiter)
+                inputFileReader = csv.reader(inputLines, delimiter=delimiter)
         except csv.Error as err:
             print("")
             print(err)
@@ -89,13 +202,42 @@ def processFile(inputFileName):
             )
             # for i in range(len(schemaData['columns'])):
 
-            inputFileHandle.seek(0)
+            inputFileReader = itertools.chain([firstRowValues], inputFileReader)
+
+    # --work out what each row is checked against once, before any worker processes copy it
+    schemaData = compileSchema(schemaData)
+    try:
+        setRecordMapper()
+    except ValueError as err:
+        print("")
+        print(err)
+        print("")
+        return 1
+
+    # --ubo owners are put in subject and depth order if asked, spilling to disk when they do not fit in memory
+    if uboSort:
+        inputFileReader = sortUboRows(inputFileReader)
+
+    if resumeRowCnt:
+        print(f"Skipping the {resumeRowCnt} rows already mapped")
+        if not isinstance(inputFileHandle, MappedLines):
+            inputFileReader = itertools.islice(inputFileReader, resumeRowCnt, None)
+    if timingSampleRate:
+        inputFileReader = timeReads(inputFileReader)
 
     # --open an output file if output is a directory
     if not outputIsFile:
-        outputFileName = outputFilePath + os.path.basename(inputFileName) + ".json"
+        outputFileName = outputFilePath + os.path.basename(inputFileName)
+        for fileExtension in compressionExtensions:
+            if outputFileName.endswith(fileExtension):
+                outputFileName = outputFileName[: -len(fileExtension)]
+        if byteRange:
+            outputFileName += ".%s-%s" % byteRange
+        outputFileName += ".json"
+        if outputCompression:
+            outputFileName += outputCompressionExtensions[outputCompression]
         try:
-            outputFileHandle = open(outputFileName, "w", encoding="utf-8")
+            outputSink = openOutputSink(outputFileName, resumeState["outputPosition"] if resumeState else None)
         except IOError as err:
             print("")
             print("Could not open output file %s for writing" % outputFileName)
@@ -103,8 +245,7 @@ def processFile(inputFileName):
             print("")
             sys.exit(1)
 
-    # --to de-dupe records if needed
-    ubo_company_cache = {}
+    # --subject and parent companies are de-duped across the whole run in ubo_company_cache
     ubo_depth_cache = {}
     # {
     #  "SUBJECT_ID": {
@@ -114,45 +255,34 @@ def processFile(inputFileName):
     #    ]
     #  }
     # }
+    uboFinishedSubjects = DunsIndex() if uboStreaming else None
+    if resumeState:
+        ubo_depth_cache = resumeState["uboDepthCache"]
+        uboFinishedSubjects = resumeState["uboFinishedSubjects"]
+    resumeState = None
+
+    # --map rows here or hand batches of them to the worker pool
+    pool = None
+    if workerCount > 1:
+        pool = multiprocessing.Pool(workerCount, initWorker, (getWorkerSettings(),))
+        rowResults = mapRowsInPool(pool, inputFileReader, resumeRowCnt + 1)
+    else:
+        rowResults = (mapRow(row, rowNum) for rowNum, row in enumerate(inputFileReader, resumeRowCnt + 1))
+
     fileStartTime = time.time()
     batchStartTime = time.time()
     badCnt = 0
-    rowCnt = 0
-    for row in inputFileReader:
-        updateStat("INPUT", "ROW_COUNT")
+    rowCnt = resumeRowCnt
+    for jsonList in rowResults:
         rowCnt += 1
-        rowData = None
-
-        # --validate json
-        if schemaData["fileType"].upper() == "JSON":
-            try:
-                rowData = json.loads(row)
-            except:
-                print("Invalid json in row %s" % rowCnt)
 
-        # --validate csv
-        elif len(row) != len(schemaData["columns"]):
-            print(
-                'Column mismatch in row %s: expected %s columns, got %s ... "%s"'
-                % (
-                    rowCnt,
-                    len(schemaData["columns"]),
-                    len(row),
-                    delimiter.join(row)[0:50],
-                )
-            )
-        elif schemaData["columns"][0].upper() + "|" + schemaData["columns"][
-            1
-        ].upper() == (str(row[0]).upper() if row[0] else "") + "|" + (
-            str(row[1]).upper() if row[1] else ""
-        ):
-            print("Column header detected in row %s" % rowCnt)
-            continue
-        else:
-            rowData = dict(zip(schemaData["columns"], row))
+        # --nothing more can be mapped right and a checkpoint would skip the row that was not
+        if uboNotGrouped:
+            shutDown = True
+            break
 
         # --bad row processing
-        if not rowData:
+        if jsonList is None:
             badCnt += 1
             if badCnt == 10 and rowCnt == 10:
                 print("")
@@ -163,40 +293,26 @@ def processFile(inputFileName):
             else:
                 continue
 
-        # --perform the mapping
-        if dnbFormat == "UBO":
-            jsonList = format_UBO(rowData)
-        elif dnbFormat == "GCA":
-            jsonList = format_GCA(rowData)
-        elif dnbFormat == "CMPCVF":
-            jsonList = format_CMPCVF(rowData)
-        elif dnbFormat == "UBO_ALONE":
-            jsonList1, ubo_company_cache = format_UBO_SUBJECT(
-                rowData, ubo_company_cache
-            )
-            jsonList2, ubo_depth_cache = format_UBO2(rowData, ubo_depth_cache)
-            jsonList = jsonList1 + jsonList2
-        else:
+        # --write each json record returned
+        writeStartNs = time.perf_counter_ns() if timingSampleRate and rowCnt % timingSampleRate == 0 else 0
+        try:
+            for dataSource, recordID, msg, dunsKey in jsonList:
+                if dataSource == "DNB-PARENT" and parentDunsIndex is not None and not parentDunsIndex.add(recordID):
+                    updateStat("DUPLICATE", "PARENT_DUNS")
+                    continue
+                if deltaIndex is not None and not deltaIndex.isChanged(dataSource, recordID, msg):
+                    continue
+                outputSink.write(dataSource, recordID, msg, dunsKey)
+                recordsWritten[dataSource] += 1
+        except IOError as err:
             print("")
-            print("No conversions for format code %s" % dnbFormat)
+            print("Could not write to %s" % outputFileName)
+            print(" %s" % err)
             print("")
             shutDown = True
             break
-
-        # --process each json record returned
-        for jsonData in jsonList:
-
-            # --write it to file
-            msg = json.dumps(jsonData)
-            try:
-                outputFileHandle.write(msg + "\n")
-            except IOError as err:
-                print("")
-                print("Could not write to %s" % outputFileName)
-                print(" %s" % err)
-                print("")
-                shutDown = True
-                break
+        if writeStartNs:
+            addStageTime("WRITE", time.perf_counter_ns() - writeStartNs)
 
         if rowCnt % progressInterval == 0:
             now = datetime.now().strftime("%I:%M%p").lower()
@@ -214,9 +330,34 @@ def processFile(inputFileName):
             batchStartTime = time.time()
             print(" %s records processed at %s, %s per second" % (rowCnt, now, eps))
 
+        # --another file failed or the user interrupted the run
+        if stopEvent and rowCnt % 1000 == 0 and stopEvent.is_set():
+            shutDown = True
+
+        if metricsFile and rowCnt % 1000 == 0 and time.time() >= nextMetricsTime:
+            writeMetrics(rowCnt, badCnt, getInputPosition(inputFileHandle))
+
+        # --the stats of a worker batch are all merged at once so checkpoints fall between batches
+        if (
+            checkpointFile
+            and (shutDown or time.time() - lastCheckpointTime >= checkpointMinutes * 60)
+            and (workerCount == 1 or (rowCnt - resumeRowCnt) % workerBatchSize == 0)
+        ):
+            try:
+                saveCheckpoint(inputFileNum - 1, rowCnt, outputSink)
+            except IOError as err:
+                print(f"\nCould not write the checkpoint to {checkpointFile}: {err}\n")
+                shutDown = True
         if shutDown:
             break
 
+    if pool:
+        if shutDown:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
     if not shutDown:
         now = datetime.now().strftime("%I:%M%p").lower()
         elapsedMins = round((time.time() - fileStartTime) / 60, 1)
@@ -234,19 +375,1334 @@ def processFile(inputFileName):
             " %s records processed at %s, %s per second, complete!" % (rowCnt, now, eps)
         )
 
+    if parentCache is not None:
+        parentCache.flushStats("PARENT_CACHE")
+    if deltaIndex is not None:
+        deltaIndex.flushRun()
+    runProgress["rowsRead"] += rowCnt
+    runProgress["badRows"] += badCnt
+    runProgress["bytesRead"] += getInputPosition(inputFileHandle) if shutDown else getInputSize(inputFileName)
+
     # --close all inputs and outputs
     # --open an output file if output is a directory
     if not outputIsFile:
-        outputFileHandle.close()
+        try:
+            outputSink.close()
+        except IOError as err:
+            print("")
+            print("Could not write to %s" % outputFileName)
+            print(" %s" % err)
+            print("")
+            shutDown = True
     inputFileHandle.close()
 
     return shutDown
 
 
+# ----------------------------------------
+def compileSchema(schemaData):
+    """copy of a schema with the file type, column count, column positions and header
+    already worked out so mapRow does not redo them on every row"""
+    compiledSchema = dict(schemaData)
+    compiledSchema["isJson"] = schemaData["fileType"].upper() == "JSON"
+    if not compiledSchema["isJson"]:
+        compiledSchema["columnNames"] = tuple(schemaData["columns"])
+        compiledSchema["columnCount"] = len(schemaData["columns"])
+        compiledSchema["columnIndex"] = {columnName: i for i, columnName in enumerate(schemaData["columns"])}
+        compiledSchema["headerKey"] = tuple(columnName.upper() for columnName in schemaData["columns"][:2])
+    return compiledSchema
+
+
+# ----------------------------------------
+def setRecordMapper():
+    """compile the recordMap of the format, if it has one, for the current schema"""
+    global recordMapper
+    recordMap = dnbFormats["mappings"][dnbFormat].get("recordMap")
+    recordMapper = compileRecordMap(dnbFormat, recordMap, schemaData) if recordMap else None
+
+
+# ----------------------------------------
+def compileRecordMap(formatCode, recordMap, schemaData):
+    """generate a python function that maps one csv row straight from its column positions as the
+    recordMap in dnb_formats.json describes, each field check and stat call is written out in full,
+    with --stats off the stat calls are left out altogether"""
+    columnIndex = schemaData["columnIndex"]
+    constants = recordMap.get("variables", {})
+    usedColumns = []
+    codeLines = []
+
+    def emit(indent, line):
+        codeLines.append("    " * indent + line)
+
+    def columnVariable(columnName):
+        if columnName not in columnIndex:
+            raise ValueError(f"Column {columnName} of the {formatCode} recordMap is not in its schema")
+        if columnName not in usedColumns:
+            usedColumns.append(columnName)
+        return "v_" + re.sub(r"\W", "_", columnName)
+
+    def templateExpression(template):
+        """python expression for a string that may contain {variable} names, constants are filled in here"""
+        parts = []
+        for i, piece in enumerate(re.split(r"\{(\w+)\}", template)):
+            isVariable = i % 2 == 1 and piece not in constants
+            text = constants[piece] if i % 2 == 1 and not isVariable else piece
+            if not isVariable and parts and not parts[-1][0]:
+                parts[-1] = (False, parts[-1][1] + text)
+            else:
+                parts.append((isVariable, text))
+        expressions = [text if isVariable else repr(text) for isVariable, text in parts if isVariable or text]
+        return " + ".join(expressions) or '""'
+
+    def statArguments(step):
+        return templateExpression(step.get("statCategory", "{recordType}")) + ", " + templateExpression(step["stat"])
+
+    def emitStat(indent, step, statValue):
+        if statsLevel != "off":
+            statCall = f"updateStat({statArguments(step)}"
+            emit(indent, f"{statCall}, {statValue})" if statValue else f"{statCall})")
+
+    def emitStep(step, indent, combineName):
+        if "combine" in step:
+            combineName = step["combine"]
+            emit(indent, f'{combineName} = ""')
+            for partStep in step["parts"]:
+                emitStep(partStep, indent, combineName)
+            if step.get("strip", True):
+                emit(indent, f"{combineName} = {combineName}.strip()")
+            if statsLevel != "off":
+                emit(indent, f"if {combineName}:")
+                emitStat(indent + 1, step, combineName if step.get("strip", True) else f"{combineName}.strip()")
+            return
+
+        valueExpression = None
+        condition = None
+        if "column" in step:
+            valueExpression = columnVariable(step["column"])
+            condition = valueExpression
+        elif "columns" in step:
+            columnVariables = [columnVariable(x) for x in step["columns"]]
+            valueExpression = "(" + ' + " " + '.join(columnVariables) + ").strip()"
+            condition = " or ".join(columnVariables)
+        elif "format" in step:
+            formatArguments = ", ".join(columnVariable(x) for x in step["formatColumns"])
+            valueExpression = f"{step['format']!r} % ({formatArguments},)"
+        elif "value" in step:
+            valueExpression = templateExpression(step["value"])
+        if step.get("always"):
+            condition = None
+        elif "when" in step:
+            condition = " and ".join(columnVariable(x) for x in step["when"])
+
+        conditionLine = len(codeLines)
+        if condition:
+            emit(indent, f"if {condition}:")
+            indent += 1
+        hasStat = "stat" in step and statsLevel != "off"
+        if valueExpression and not valueExpression.isidentifier() and (combineName or hasStat):
+            emit(indent, f"value = {valueExpression}")
+            valueExpression = "value"
+        if "attribute" in step:
+            storedValue = f"float({valueExpression})" if step.get("type") == "float" else valueExpression
+            assignment = "+=" if step.get("append") else "="
+            emit(indent, f"jsonData[{templateExpression(step['attribute'])}] {assignment} {storedValue}")
+        if combineName:
+            emit(indent, f'{combineName} += " " + {valueExpression}')
+        if "stat" in step:
+            emitStat(indent, step, step.get("statValue", valueExpression))
+        for thenStep in step.get("then", []):
+            emitStep(thenStep, indent, None)
+        # --a check that was only there for its stat call is dropped along with it
+        if condition and len(codeLines) == conditionLine + 1:
+            codeLines.pop()
+
+    for fix in recordMap.get("fixes", []):
+        fixVariable = columnVariable(fix["column"])
+        # --sometimes they prepended file name to first column like this: UBO_00_0819.txt:021475652
+        if fix["transform"] == "afterColon":
+            emit(1, f'if ":" in {fixVariable}:')
+            emit(2, f'{fixVariable} = {fixVariable}[{fixVariable}.find(":") + 1 :]')
+        else:
+            raise ValueError(f"Unknown transform {fix['transform']} in the {formatCode} recordMap")
+    if "cases" in recordMap:
+        caseVariable = columnVariable(recordMap["cases"]["column"])
+        for i, (caseValue, caseVariables) in enumerate(recordMap["cases"]["values"].items()):
+            emit(1, f"{'elif' if i else 'if'} {caseVariable} == {caseValue!r}:")
+            for variableName, variableValue in caseVariables.items():
+                emit(2, f"{variableName} = {variableValue!r}")
+        emit(1, "else:")
+        for variableName, variableValue in recordMap["cases"]["default"].items():
+            emit(2, f"{variableName} = {variableValue!r}")
+    emit(1, "jsonData = {}")
+    for step in recordMap["steps"]:
+        emitStep(step, 1, None)
+    emit(1, "return [jsonData]  # --must return a list even though only 1")
+
+    # --the columns used are all read from the row at once
+    columnPositions = [columnIndex[x] for x in usedColumns]
+    mapperName = "map_" + re.sub(r"\W", "_", formatCode)
+    if len(usedColumns) == 1:
+        readColumns = f"    {columnVariable(usedColumns[0])} = row[{columnPositions[0]}]"
+    else:
+        readColumns = f"    {', '.join(columnVariable(x) for x in usedColumns)} = rowGetter(row)"
+    mapperSource = "\n".join([f"def {mapperName}(row, rowGetter=rowGetter):", readColumns] + codeLines)
+    mapperNamespace = {"rowGetter": operator.itemgetter(*columnPositions)}
+    mapperCode = compile(mapperSource + "\n", f"<{formatCode} recordMap>", "exec")
+    exec(mapperCode, globals(), mapperNamespace)  # pylint: disable=exec-used
+    recordMapper = mapperNamespace[mapperName]
+    recordMapper.source = mapperSource
+    return recordMapper
+
+
+# ----------------------------------------
+def mapRow(row, rowCnt):
+    """validate and map one input row, returns the data source, record id, json string and
+    shard key of each record to write or None if the row is bad"""
+    updateStat("INPUT", "ROW_COUNT")
+    rowData = None
+    timeRow = timingSampleRate and rowCnt % timingSampleRate == 0
+    if timeRow:
+        startNs = time.perf_counter_ns()
+
+    # --validate json
+    if schemaData["isJson"]:
+        try:
+            rowData = jsonLoads(row)
+        except:
+            print("Invalid json in row %s" % rowCnt)
+
+    # --validate csv
+    elif len(row) != schemaData["columnCount"]:
+        print(
+            'Column mismatch in row %s: expected %s columns, got %s ... "%s"'
+            % (
+                rowCnt,
+                schemaData["columnCount"],
+                len(row),
+                delimiter.join(row)[0:50],
+            )
+        )
+    elif row[0].upper() == schemaData["headerKey"][0] and row[1].upper() == schemaData["headerKey"][1]:
+        print("Column header detected in row %s" % rowCnt)
+        return []
+    elif recordMapper is not None:
+        rowData = row
+    else:
+        rowData = dict(zip(schemaData["columnNames"], row))
+
+    if not rowData:
+        return None
+
+    if timeRow:
+        return mapRowTimed(rowData, startNs)
+    return dumpRecords(mapRowData(rowData), rowData)
+
+
+# ----------------------------------------
+def mapRowData(rowData):
+    """the json records of a validated row"""
+    global ubo_company_cache, ubo_depth_cache
+    if recordMapper is not None:
+        return recordMapper(rowData)
+    if dnbFormat == "CMPCVF":
+        return format_CMPCVF(rowData)
+
+    # --UBO_ALONE
+    jsonList1, ubo_company_cache = format_UBO_SUBJECT(rowData, ubo_company_cache)
+    if uboFinishedSubjects is not None:
+        ubo_depth_cache = evictFinishedSubjects(rowData["SUBJ_DUNS"], ubo_depth_cache)
+        if uboNotGrouped:
+            return []
+    jsonList2, ubo_depth_cache = format_UBO2(rowData, ubo_depth_cache)
+    return jsonList1 + jsonList2
+
+
+# ----------------------------------------
+def dumpRecords(jsonList, rowData):
+    """the json of each record with what the output needs to file it, its data source, record id and
+    shard key. UBO_ALONE owners point at the owner one level up, so all the records of a row follow its subject."""
+    if outputShards > 1 and dnbFormat == "UBO_ALONE":
+        return [
+            (jsonData["DATA_SOURCE"], jsonData.get("RECORD_ID"), jsonDumpsBytes(jsonData), rowData["SUBJ_DUNS"])
+            for jsonData in jsonList
+        ]
+    return [
+        (
+            jsonData["DATA_SOURCE"],
+            jsonData.get("RECORD_ID"),
+            jsonDumpsBytes(jsonData),
+            getDunsKey(jsonData) if outputShards > 1 else None,
+        )
+        for jsonData in jsonList
+    ]
+
+
+# ----------------------------------------
+def mapRowTimed(rowData, startNs):
+    """mapRow for a sampled row, the time spent in updateStat is taken out of the mapping time"""
+    global updateStat, untimedUpdateStat, statNs
+    parsedNs = time.perf_counter_ns()
+    addStageTime("PARSE", parsedNs - startNs)
+    untimedUpdateStat, updateStat, statNs = updateStat, updateStatTimed, 0
+    try:
+        jsonList = mapRowData(rowData)
+    finally:
+        updateStat = untimedUpdateStat
+    mappedNs = time.perf_counter_ns()
+    addStageTime("MAP", mappedNs - parsedNs - statNs)
+    addStageTime("STATS", statNs)
+    recordList = dumpRecords(jsonList, rowData)
+    addStageTime("DUMPS", time.perf_counter_ns() - mappedNs)
+    return recordList
+
+
+# ----------------------------------------
+def updateStatTimed(cat1, cat2, example=None):
+    global statNs
+    startNs = time.perf_counter_ns()
+    untimedUpdateStat(cat1, cat2, example)
+    statNs += time.perf_counter_ns() - startNs
+
+
+# ----------------------------------------
+def addStageTime(stageName, elapsedNs):
+    """add a sampled span to the stage's total and its histogram of power of two buckets"""
+    try:
+        stageData = statPack["TIMING"][stageName]
+    except KeyError:
+        stageData = statPack.setdefault("TIMING", {}).setdefault(stageName, {"count": 0, "totalNs": 0, "histogram": {}})
+    stageData["count"] += 1
+    stageData["totalNs"] += elapsedNs
+    bucketLabel = timingBucketLabels[min(max(elapsedNs, 1).bit_length(), len(timingBucketLabels) - 1)]
+    stageData["histogram"][bucketLabel] = stageData["histogram"].get(bucketLabel, 0) + 1
+
+
+# ----------------------------------------
+def getTimingBucketLabels():
+    """labels for spans under 2^n nanoseconds up to about a minute, the power is zero padded so the
+    stats file lists them in order"""
+    bucketLabels = []
+    for bucketNum in range(37):
+        upperNs = 2**bucketNum
+        if upperNs < 10**3:
+            upperTime = f"{upperNs}ns"
+        elif upperNs < 10**6:
+            upperTime = f"{upperNs / 10**3:.3g}us"
+        elif upperNs < 10**9:
+            upperTime = f"{upperNs / 10**6:.3g}ms"
+        else:
+            upperTime = f"{upperNs / 10**9:.3g}s"
+        bucketLabels.append(f"<2^{bucketNum:02d}ns ({upperTime})")
+    bucketLabels.append(">=2^36ns (68.7s)")
+    return bucketLabels
+
+
+timingBucketLabels = getTimingBucketLabels()
+
+
+# ----------------------------------------
+def timeReads(inputFileReader):
+    """time reading every timingSampleRate'th row, csv rows are split into columns as they are read"""
+    rowIterator = iter(inputFileReader)
+    rowCnt = 0
+    while True:
+        rowCnt += 1
+        if rowCnt % timingSampleRate:
+            row = next(rowIterator, None)
+        else:
+            startNs = time.perf_counter_ns()
+            row = next(rowIterator, None)
+            addStageTime("READ", time.perf_counter_ns() - startNs)
+        if row is None:
+            return
+        yield row
+
+
+# ----------------------------------------
+def getDunsKey(jsonData):
+    """the duns a record hangs off, its own anchor or else the company it points to, so all the
+    records of an organization land in the same output shard"""
+    for relationshipKey in ("REL_ANCHOR_KEY", "REL_POINTER_KEY"):
+        if jsonData.get(relationshipKey):
+            return jsonData[relationshipKey]
+    for relationshipList in ("RELATIONSHIP_LIST", "RELATIONSHIPS"):
+        for relationshipData in jsonData.get(relationshipList, []):
+            for relationshipKey in ("REL_ANCHOR_KEY", "REL_POINTER_KEY"):
+                if relationshipData.get(relationshipKey):
+                    return relationshipData[relationshipKey]
+    return jsonData.get("RECORD_ID")
+
+
+# ----------------------------------------
+def getWorkerSettings():
+    """the globals a worker process needs to map rows the same way this one does"""
+    return {settingName: globals()[settingName] for settingName in workerSettingNames if settingName in globals()}
+
+
+# ----------------------------------------
+def initWorker(workerSettings):
+    """runs once in each worker process, the parent handles interrupts and writes the output"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    global shutDown
+    resetStats()
+    shutDown = False
+    globals().update(workerSettings)
+    setJsonBackend(jsonBackend, compactJson)
+    setStatsLevel(statsLevel)
+    setParentCache(parentCacheSize)
+
+    # --row workers start once the schema is compiled, file workers compile it in processFile
+    if "isJson" in globals().get("schemaData", {}):
+        setRecordMapper()
+
+
+# ----------------------------------------
+def initFileWorker(workerSettings, workerStopEvent, sharedParentDunsIndex, sharedUboCompanyCache):
+    """runs once in each process that maps whole files, these shut down on their own when interrupted"""
+    initWorker(workerSettings)
+    signal.signal(signal.SIGINT, signal_handler)
+    global stopEvent, workerCount, parentDunsIndex, ubo_company_cache, deltaIndex
+    stopEvent = workerStopEvent
+    workerCount = 1
+    parentDunsIndex = sharedParentDunsIndex
+    ubo_company_cache = sharedUboCompanyCache
+    if deltaRunDirectory:
+        deltaIndex = DeltaIndex(previousIndexFile, deltaRunDirectory, sortMemoryMb * 1024 * 1024)
+
+
+# ----------------------------------------
+def processFileInWorker(inputFileName):
+    """map one file in a file worker, returning whether it ran, its shutdown status and its stats"""
+    resetStats()
+    if stopEvent.is_set():
+        return False, True, statPack
+
+    print(f"\nProcessing {inputFileName} in process {os.getpid()}...\n")
+    try:
+        fileShutDown = processFile(inputFileName)
+    except:
+        print(f"\nError processing {inputFileName}: {sys.exc_info()[1]}\n")
+        fileShutDown = True
+    if fileShutDown:
+        stopEvent.set()
+    return True, fileShutDown, statPack
+
+
+# ----------------------------------------
+def mapBatch(batch):
+    """map a batch of rows in a worker, returning the results and the stats they produced"""
+    resetStats()
+    firstRowCnt, rows = batch
+    rowResults = [mapRow(row, firstRowCnt + i) for i, row in enumerate(rows)]
+    if parentCache is not None:
+        parentCache.flushStats("PARENT_CACHE")
+    return rowResults, statPack
+
+
+# ----------------------------------------
+def getCompression(inputFileName):
+    """detect a compressed file by its extension or else its first few bytes"""
+    for fileExtension, compression in compressionExtensions.items():
+        if inputFileName.lower().endswith(fileExtension):
+            return compression
+    with open(inputFileName, "rb") as inputFileHandle:
+        fileHeader = inputFileHandle.read(6)
+    for magicBytes, compression in compressionMagicBytes.items():
+        if fileHeader.startswith(magicBytes):
+            return compression
+    return None
+
+
+# ----------------------------------------
+def openInputFile(inputFileName, encoding=None, binary=False):
+    """open an input file as text or bytes, decompressing it on the fly if needed"""
+    compression = getCompression(inputFileName)
+    fileMode, encoding = ("rb", None) if binary else ("rt", encoding)
+    if compression == "gzip":
+        return gzip.open(inputFileName, fileMode, encoding=encoding)
+    if compression == "bz2":
+        return bz2.open(inputFileName, fileMode, encoding=encoding)
+    if compression == "xz":
+        return lzma.open(inputFileName, fileMode, encoding=encoding)
+    return open(inputFileName, fileMode, encoding=encoding)
+
+
+# ----------------------------------------
+def readBinaryLines(inputFileHandle, encoding):
+    """the lines of a binary file as bytes for the json parser, decoding only those that are not
+    plain ascii when the file is not utf-8"""
+    isUtf8 = codecs.lookup(encoding).name == "utf-8"
+    for line in inputFileHandle:
+        yield line if isUtf8 or line.isascii() else line.decode(encoding)
+
+
+# ----------------------------------------
+def openOutputFile(outputFileName, append=False):
+    """open an output file, compressing it on a background thread if asked to"""
+    if outputCompression:
+        return CompressedWriter(outputFileName, outputCompression, append)
+    return open(outputFileName, "ab" if append else "wb", buffering=outputBufferSize)
+
+
+# ----------------------------------------
+def openOutputSink(outputFileName, outputPosition=None):
+    """the sink the mapped records of a run or file are written to, - writes them to stdout"""
+    if outputFileName == "-":
+        return StreamSink(sys.__stdout__.buffer, outputBatchSize)
+    if outputShards > 1:
+        shardFileNames = [getShardFileName(outputFileName, shardNum) for shardNum in range(outputShards)]
+        return ShardedSink(shardFileNames, outputBatchSize, outputPosition)
+    return FileSink(outputFileName, outputBatchSize, outputPosition)
+
+
+# ----------------------------------------
+def getShardFileName(outputFileName, shardNum):
+    """the shard number goes in front of the .json and compression extensions, out.json.gz becomes out.03.json.gz"""
+    shardName, shardExtension = outputFileName, ""
+    for fileExtension in list(outputCompressionExtensions.values()) + [".json"]:
+        if shardName.endswith(fileExtension):
+            shardName, shardExtension = shardName[: -len(fileExtension)], fileExtension + shardExtension
+    return f"{shardName}.{shardNum:0{len(str(outputShards - 1))}d}{shardExtension}"
+
+
+# ----------------------------------------
+class MappedLines:
+    """an uncompressed input file mapped into memory. Lines are sliced straight out of the mapping as
+    bytes for the json parser, only those that are not plain ascii are decoded when the file is not
+    utf-8. The offset of every line start is indexed a chunk at a time the first time it is needed."""
+
+    def __init__(self, inputFileName, encoding):
+        self.fileHandle = open(inputFileName, "rb")
+        self.fileSize = os.fstat(self.fileHandle.fileno()).st_size
+        self.mappedFile = mmap.mmap(self.fileHandle.fileno(), 0, access=mmap.ACCESS_READ) if self.fileSize else b""
+        self.encoding = encoding
+        self.isUtf8 = codecs.lookup(encoding).name == "utf-8"
+        self.lineOffsets = None
+        self.filePos = 0
+
+    def close(self):
+        if self.fileSize:
+            self.mappedFile.close()
+        self.fileHandle.close()
+
+    def getLineStart(self, filePos):
+        """where the first line starting at or after filePos starts"""
+        if filePos <= 0:
+            return 0
+        newlinePos = self.mappedFile.find(b"\n", filePos - 1)
+        return self.fileSize if newlinePos < 0 else newlinePos + 1
+
+    def getLineOffsets(self):
+        """array of the offset each line starts at, from the line lengths of each chunk split at once"""
+        if self.lineOffsets is None:
+            self.lineOffsets = array.array("q")
+            filePos = 0
+            while filePos < self.fileSize:
+                chunkEnd = self.fileSize
+                if filePos + mappedChunkSize < self.fileSize:
+                    chunkEnd = self.mappedFile.rfind(b"\n", filePos, filePos + mappedChunkSize) + 1
+                    if not chunkEnd:
+                        chunkEnd = self.getLineStart(filePos + mappedChunkSize)
+                lineList = self.mappedFile[filePos:chunkEnd].split(b"\n")
+                if not lineList[-1]:
+                    lineList.pop()
+                lineSizes = map(operator.add, map(len, lineList), itertools.repeat(1))
+                lineStarts = itertools.accumulate(lineSizes, initial=filePos)
+                self.lineOffsets.extend(itertools.islice(lineStarts, len(lineList)))
+                filePos = chunkEnd
+        return self.lineOffsets
+
+    def __len__(self):
+        return len(self.getLineOffsets())
+
+    def getLine(self, lineNum):
+        lineOffsets = self.getLineOffsets()
+        lineEnd = lineOffsets[lineNum + 1] if lineNum + 1 < len(lineOffsets) else self.fileSize
+        line = self.mappedFile[lineOffsets[lineNum] : lineEnd].rstrip(b"\n")
+        return line if self.isUtf8 or line.isascii() else line.decode(self.encoding)
+
+    def iterLines(self, startPos=0, endPos=None, skipLines=0):
+        """yield the lines that start within [startPos, endPos) so byte ranges never split or repeat
+        a line, skipping the first skipLines of them through the line index"""
+        startPos = self.getLineStart(startPos)
+        endPos = self.fileSize if endPos is None or endPos >= self.fileSize else self.getLineStart(endPos)
+        if skipLines:
+            lineOffsets = self.getLineOffsets()
+            lineNum = bisect.bisect_left(lineOffsets, startPos) + skipLines
+            startPos = min(lineOffsets[lineNum] if lineNum < len(lineOffsets) else self.fileSize, endPos)
+
+        mappedFile = self.mappedFile
+        self.filePos = startPos
+        while self.filePos < endPos:
+            lineEnd = mappedFile.find(b"\n", self.filePos, endPos)
+            if lineEnd < 0:
+                lineEnd = endPos
+            line = mappedFile[self.filePos : lineEnd]
+            self.filePos = lineEnd + 1
+            yield line if self.isUtf8 or line.isascii() else line.decode(self.encoding)
+
+
+# ----------------------------------------
+class CompressedWriter:
+    """file like writer that hands chunks of output to a compression thread through a bounded queue"""
+
+    def __init__(self, outputFileName, compression, append=False, chunkSize=1048576, queueSize=16):
+        # --appending starts a new gzip member or xz stream, which are read back as one
+        if compression == "xz":
+            self.fileHandle = lzma.open(outputFileName, "ab" if append else "wb")
+        else:
+            self.fileHandle = gzip.open(outputFileName, "ab" if append else "wb")
+        self.chunkSize = chunkSize
+        self.chunkList = []
+        self.chunkLength = 0
+        self.writeError = None
+        self.chunkQueue = queue.Queue(maxsize=queueSize)
+        self.compressThread = threading.Thread(target=self.compressChunks, daemon=True)
+        self.compressThread.start()
+
+    def write(self, msg):
+        self.chunkList.append(msg)
+        self.chunkLength += len(msg)
+        if self.chunkLength >= self.chunkSize:
+            self.queueChunk()
+
+    def queueChunk(self):
+        if self.writeError:
+            raise IOError(self.writeError)
+        if self.chunkList:
+            self.chunkQueue.put(b"".join(self.chunkList))
+            self.chunkList = []
+            self.chunkLength = 0
+
+    def compressChunks(self):
+        while True:
+            chunk = self.chunkQueue.get()
+            if chunk is None:
+                break
+            if not self.writeError:
+                try:
+                    self.fileHandle.write(chunk)
+                except (IOError, lzma.LZMAError) as err:
+                    self.writeError = err
+
+    def close(self):
+        self.queueChunk()
+        self.chunkQueue.put(None)
+        self.compressThread.join()
+        self.fileHandle.close()
+        if self.writeError:
+            raise IOError(self.writeError)
+
+
+# ----------------------------------------
+class OutputSink(abc.ABC):
+    """where the mapped records go, they are collected and handed over batchSize records at a time
+    as lists of (dataSource, recordID, msg) tuples with msg as utf-8 json bytes, write errors are
+    raised as IOError. A new kind of output only needs a writeBatch."""
+
+    def __init__(self, batchSize):
+        self.batchSize = batchSize
+        self.recordBatch = []
+
+    def write(self, dataSource, recordID, msg, shardKey=None):
+        self.recordBatch.append((dataSource, recordID, msg))
+        if len(self.recordBatch) >= self.batchSize:
+            self.flushBatch()
+
+    def flushBatch(self):
+        if self.recordBatch:
+            recordBatch = self.recordBatch
+            self.recordBatch = []
+            self.writeBatch(recordBatch)
+
+    @abc.abstractmethod
+    def writeBatch(self, recordBatch):
+        """write or hand on one batch of records"""
+
+    def sync(self):
+        """make everything written so far durable, returns the position to resume from"""
+        self.flushBatch()
+
+    def close(self):
+        self.flushBatch()
+
+
+# ----------------------------------------
+class FileSink(OutputSink):
+    """json lines written to a file, a resumed file is first cut back to its checkpoint position"""
+
+    def __init__(self, outputFileName, batchSize, outputPosition=None):
+        super().__init__(batchSize)
+        self.outputFileName = outputFileName
+        if outputPosition is not None:
+            if not os.path.exists(outputFileName) or os.path.getsize(outputFileName) < outputPosition:
+                raise IOError(f"{outputFileName} is shorter than its checkpoint")
+            os.truncate(outputFileName, outputPosition)
+        self.fileHandle = openOutputFile(outputFileName, append=outputPosition is not None)
+
+    def writeBatch(self, recordBatch):
+        self.fileHandle.write(b"\n".join([msg for _, _, msg in recordBatch]) + b"\n")
+
+    def sync(self):
+        self.flushBatch()
+        if isinstance(self.fileHandle, CompressedWriter):
+            self.fileHandle.close()
+            self.fileHandle = openOutputFile(self.outputFileName, append=True)
+        else:
+            self.fileHandle.flush()
+            os.fsync(self.fileHandle.fileno())
+        return os.path.getsize(self.outputFileName)
+
+    def close(self):
+        self.flushBatch()
+        self.fileHandle.close()
+
+
+# ----------------------------------------
+class StreamSink(OutputSink):
+    """json lines written to a stream such as stdout piped into a loader, flushed after each batch"""
+
+    def __init__(self, outputStream, batchSize):
+        super().__init__(batchSize)
+        self.outputStream = outputStream
+
+    def writeBatch(self, recordBatch):
+        self.outputStream.write(b"\n".join([msg for _, _, msg in recordBatch]) + b"\n")
+        self.outputStream.flush()
+
+
+# ----------------------------------------
+class ShardedSink(OutputSink):
+    """json lines spread over several files by a hash of each record's shard key or else its record id,
+    each file batched and buffered on its own"""
+
+    def __init__(self, outputFileNames, batchSize, outputPositions=None):
+        super().__init__(batchSize)
+        self.shardSinks = []
+        for shardNum, outputFileName in enumerate(outputFileNames):
+            self.shardSinks.append(
+                FileSink(outputFileName, batchSize, outputPositions[shardNum] if outputPositions else None)
+            )
+
+    def write(self, dataSource, recordID, msg, shardKey=None):
+        shardNum = getHash64(shardKey or recordID or msg) % len(self.shardSinks)
+        self.shardSinks[shardNum].write(dataSource, recordID, msg)
+
+    def writeBatch(self, recordBatch):
+        for dataSource, recordID, msg in recordBatch:
+            self.write(dataSource, recordID, msg)
+
+    def sync(self):
+        return [shardSink.sync() for shardSink in self.shardSinks]
+
+    def close(self):
+        for shardSink in self.shardSinks:
+            shardSink.close()
+
+
+# ----------------------------------------
+class CallbackSink(OutputSink):
+    """hands each batch to a function, such as a loader running in this process or a stand-in for one"""
+
+    def __init__(self, callback, batchSize):
+        super().__init__(batchSize)
+        self.callback = callback
+
+    def writeBatch(self, recordBatch):
+        self.callback(recordBatch)
+
+
+# ----------------------------------------
+class LruCache:
+    """bounded mapping that drops the least recently used entry when full and counts its hits and misses,
+    an entry put with a fingerprint is only found again with an equal one"""
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.cacheData = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, fingerprint=None):
+        try:
+            cachedFingerprint, value = self.cacheData[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        if cachedFingerprint != fingerprint:
+            self.misses += 1
+            return None
+        self.cacheData.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, fingerprint=None):
+        self.cacheData[key] = (fingerprint, value)
+        self.cacheData.move_to_end(key)
+        if len(self.cacheData) > self.maxSize:
+            self.cacheData.popitem(last=False)
+
+    def flushStats(self, cat1):
+        """add the hits and misses since the last flush to the stats"""
+        if statsLevel != "off":
+            for cat2, count in (("HITS", self.hits), ("MISSES", self.misses)):
+                if count:
+                    statData = statPack.setdefault(cat1, {}).setdefault(cat2, {"count": 0})
+                    statData["count"] += count
+        self.hits = 0
+        self.misses = 0
+
+
+# ----------------------------------------
+class DunsIndex:
+    """compact set of DUNS numbers with a bit for every possible 9 digit DUNS, about 125MB once used.
+    A shared index can be handed to worker processes, anything that is not a 9 digit number is kept
+    in a plain set that is not shared."""
+
+    def __init__(self, shared=False):
+        self.bitmap = multiprocessing.RawArray("B", dunsBitmapSize) if shared else None
+        self.lock = multiprocessing.Lock() if shared else None
+        self.otherDuns = set()
+
+    def __contains__(self, duns):
+        duns = str(duns)
+        if len(duns) == 9 and duns.isascii() and duns.isdigit():
+            dunsNumber = int(duns)
+            return self.bitmap is not None and self.bitmap[dunsNumber >> 3] & (1 << (dunsNumber & 7)) != 0
+        return duns in self.otherDuns
+
+    def add(self, duns):
+        """add a DUNS, returns False if it was already there"""
+        if self.lock:
+            with self.lock:
+                return self.addDuns(duns)
+        return self.addDuns(duns)
+
+    def addDuns(self, duns):
+        duns = str(duns)
+        if len(duns) == 9 and duns.isascii() and duns.isdigit():
+            dunsNumber = int(duns)
+            if self.bitmap is None:
+                self.bitmap = bytearray(dunsBitmapSize)
+            bitMask = 1 << (dunsNumber & 7)
+            if self.bitmap[dunsNumber >> 3] & bitMask:
+                return False
+            self.bitmap[dunsNumber >> 3] |= bitMask
+            return True
+        if duns in self.otherDuns:
+            return False
+        self.otherDuns.add(duns)
+        return True
+
+    def getDunsNumbers(self):
+        """the 9 digit DUNS numbers in the index in order, found a non-zero byte at a time"""
+        dunsNumbers = array.array("I")
+        if self.bitmap is not None:
+            for bitmapByte in re.finditer(rb"[^\x00]", memoryview(self.bitmap).cast("B")):
+                byteNumber = bitmapByte.start()
+                byteValue = self.bitmap[byteNumber]
+                for bitNumber in range(8):
+                    if byteValue & (1 << bitNumber):
+                        dunsNumbers.append(byteNumber * 8 + bitNumber)
+        return dunsNumbers
+
+    def save(self, outputFileHandle):
+        """write the index as a json header line followed by its 9 digit DUNS as 4 byte integers"""
+        dunsNumbers = self.getDunsNumbers()
+        if sys.byteorder != "little":
+            dunsNumbers.byteswap()
+        header = {"dunsCount": len(dunsNumbers), "otherDuns": sorted(self.otherDuns)}
+        outputFileHandle.write(json.dumps(header).encode("utf-8") + b"\n")
+        dunsNumbers.tofile(outputFileHandle)
+
+    def load(self, inputFileHandle):
+        """add the DUNS written by save"""
+        header = json.loads(inputFileHandle.readline())
+        dunsNumbers = array.array("I")
+        dunsNumbers.fromfile(inputFileHandle, header["dunsCount"])
+        if sys.byteorder != "little":
+            dunsNumbers.byteswap()
+        for dunsNumber in dunsNumbers:
+            self.addDuns("%09d" % dunsNumber)
+        for duns in header["otherDuns"]:
+            self.addDuns(duns)
+
+
+# ----------------------------------------
+def getHash64(text):
+    textBytes = text.encode("utf-8") if isinstance(text, str) else text
+    return int.from_bytes(hashlib.blake2b(textBytes, digest_size=8).digest(), "little")
+
+
+# ----------------------------------------
+class DeltaIndex:
+    """64 bit fingerprints of the json records mapped by the previous run, looked up straight from the index
+    file on disk, and the fingerprints of the records mapped by this run, spilled to sorted run files that
+    finishDeltaIndex merges into the next index. The index file holds the sorted hashes of the
+    data source and record id of every record followed by the hashes of their json in the same order.
+    Run lines carry when they were written, newest first, so a record written twice keeps its last json."""
+
+    def __init__(self, previousIndexFile, runDirectory, memoryBytes):
+        self.previousKeys = ()
+        self.previousFingerprints = ()
+        if previousIndexFile and os.path.exists(previousIndexFile) and os.path.getsize(previousIndexFile):
+            with open(previousIndexFile, "rb") as indexFileHandle:
+                indexMap = mmap.mmap(indexFileHandle.fileno(), 0, access=mmap.ACCESS_READ)
+            indexValues = memoryview(indexMap).cast("Q")  # --the view keeps the file mapped
+            self.previousKeys = indexValues[: len(indexValues) // 2]
+            self.previousFingerprints = indexValues[len(indexValues) // 2 :]
+        self.runDirectory = runDirectory
+        self.memoryBytes = memoryBytes
+        self.runLines = []
+        self.runBytes = 0
+        self.writeTime = 0
+
+    def isChanged(self, dataSource, recordID, jsonString):
+        """remember the record for the next index, returns False if it is the same as last run"""
+        if not recordID:
+            updateStat("DELTA", "NO_RECORD_ID")
+            return True
+        recordKey = f"{dataSource}\t{recordID}"
+        keyHash = getHash64(recordKey)
+        fingerprint = getHash64(jsonString)
+        self.writeTime = max(time.time_ns(), self.writeTime + 1)
+        runLine = "%016x %016x %016x %s\n" % (keyHash, ~self.writeTime & 0xFFFFFFFFFFFFFFFF, fingerprint, recordKey)
+        self.runLines.append(runLine)
+        self.runBytes += len(runLine) + 100  # --rough size in memory
+        if self.runBytes >= self.memoryBytes:
+            self.flushRun()
+
+        keyPos = bisect.bisect_left(self.previousKeys, keyHash)
+        if keyPos < len(self.previousKeys) and self.previousKeys[keyPos] == keyHash:
+            if self.previousFingerprints[keyPos] == fingerprint:
+                updateStat("DELTA", "UNCHANGED")
+                return False
+            updateStat("DELTA", "CHANGED")
+            return True
+        updateStat("DELTA", "NEW")
+        return True
+
+    def flushRun(self):
+        if not self.runLines:
+            return
+        self.runLines.sort()
+        # --named after the last write in it, which no other run of this process can share
+        runFileName = os.path.join(self.runDirectory, f"{os.getpid()}-{self.writeTime}.run")
+        with open(runFileName, "w", encoding="utf-8") as runFileHandle:
+            runFileHandle.writelines(self.runLines)
+        self.runLines = []
+        self.runBytes = 0
+
+
+# ----------------------------------------
+def finishDeltaIndex(indexFileName, runDirectory, deleteFileName=None):
+    """merge the sorted runs of every process into the index for the next run, records mapped
+    more than once are only kept once, with the json written last. The hash and id of each record
+    are also kept in a text file next to the index, which the previous one is compared to in the
+    same pass to write a delete record for each record that is gone. Returns the record and delete counts."""
+    runFileHandles = [open(x, "r", encoding="utf-8") for x in sorted(glob.glob(os.path.join(runDirectory, "*.run")))]
+    previousIdFileHandle = None
+    deleteFileHandle = None
+    if deleteFileName and os.path.exists(indexFileName + ".ids"):
+        previousIdFileHandle = open(indexFileName + ".ids", "r", encoding="utf-8")
+    if deleteFileName:
+        deleteFileHandle = openOutputFile(deleteFileName)
+    keyFileName = os.path.join(runDirectory, "keys.tmp")
+    fingerprintFileName = os.path.join(runDirectory, "fingerprints.tmp")
+    idFileName = os.path.join(runDirectory, "ids.tmp")
+    recordCount = 0
+    deleteCount = 0
+
+    def writeDeletes(untilKeyHash):
+        """delete the previous records that sort before this key, skipping the one that matches it"""
+        nonlocal previousIdLine, deleteCount
+        while previousIdLine and (untilKeyHash is None or previousIdLine[:16] < untilKeyHash):
+            dataSource, recordID = previousIdLine[34:-1].split("\t", 1)
+            if dataSource in deleteDataSources:
+                deleteFileHandle.write(jsonDumpsBytes({"DATA_SOURCE": dataSource, "RECORD_ID": recordID}) + b"\n")
+                deleteCount += 1
+            previousIdLine = previousIdFileHandle.readline()
+        if previousIdLine and previousIdLine[:16] == untilKeyHash:
+            previousIdLine = previousIdFileHandle.readline()
+
+    previousIdLine = previousIdFileHandle.readline() if previousIdFileHandle else ""
+    try:
+        with open(keyFileName, "wb") as keyFileHandle, open(fingerprintFileName, "wb") as fingerprintFileHandle, open(
+            idFileName, "w", encoding="utf-8"
+        ) as idFileHandle:
+            keyHashes = array.array("Q")
+            fingerprints = array.array("Q")
+            lastKeyHash = None
+            for runLine in heapq.merge(*runFileHandles):
+                # --the newest line of a record sorts first
+                if runLine[:16] == lastKeyHash:
+                    continue
+                lastKeyHash = runLine[:16]
+                if previousIdLine:
+                    writeDeletes(lastKeyHash)
+                keyHashes.append(int(runLine[:16], 16))
+                fingerprints.append(int(runLine[34:50], 16))
+                idFileHandle.write(runLine[:17] + runLine[34:])
+                recordCount += 1
+                if len(keyHashes) >= 1000000:
+                    keyHashes.tofile(keyFileHandle)
+                    fingerprints.tofile(fingerprintFileHandle)
+                    keyHashes = array.array("Q")
+                    fingerprints = array.array("Q")
+            keyHashes.tofile(keyFileHandle)
+            fingerprints.tofile(fingerprintFileHandle)
+            writeDeletes(None)
+    finally:
+        for runFileHandle in runFileHandles:
+            runFileHandle.close()
+        if previousIdFileHandle:
+            previousIdFileHandle.close()
+        if deleteFileHandle:
+            deleteFileHandle.close()
+
+    with open(keyFileName, "ab") as keyFileHandle, open(fingerprintFileName, "rb") as fingerprintFileHandle:
+        shutil.copyfileobj(fingerprintFileHandle, keyFileHandle)
+    os.replace(keyFileName, indexFileName)
+    os.replace(idFileName, indexFileName + ".ids")
+    return recordCount, deleteCount
+
+
+# ----------------------------------------
+def saveCheckpoint(fileNum, rowCnt, checkpointSink):
+    """write everything needed to carry on after rowCnt rows of the file at fileNum, the output
+    is synced to disk first so the checkpoint never points past what was written"""
+    global lastCheckpointTime
+    outputPosition = checkpointSink.sync() if checkpointSink else None
+    if parentCache is not None:
+        parentCache.flushStats("PARENT_CACHE")
+    if deltaIndex is not None:
+        deltaIndex.flushRun()
+
+    # --the depth charts only matter part way through a file
+    midFile = rowCnt > 0
+    checkpointData = {
+        "dnbFormat": dnbFormat,
+        "inputFiles": checkpointInputFiles,
+        "fileNum": fileNum,
+        "rowCnt": rowCnt,
+        "outputPosition": outputPosition,
+        "statPack": statPack,
+        "statExamples": [[cat1, cat2, *exampleSample[1:]] for (cat1, cat2), exampleSample in statExamples.items()],
+        "statRandom": statRandom.getstate(),
+        "uboDepthCache": ubo_depth_cache if midFile else {},
+        "deltaRunFiles": sorted(os.listdir(deltaRunDirectory)) if deltaRunDirectory else [],
+        "hasParentDunsIndex": parentDunsIndex is not None,
+        "hasFinishedSubjects": midFile and uboFinishedSubjects is not None,
+    }
+    tempFileName = checkpointFile + ".tmp"
+    with open(tempFileName, "wb") as checkpointFileHandle:
+        checkpointFileHandle.write(json.dumps(checkpointData).encode("utf-8") + b"\n")
+        if parentDunsIndex is not None:
+            parentDunsIndex.save(checkpointFileHandle)
+        ubo_company_cache["subject"].save(checkpointFileHandle)
+        ubo_company_cache["parent"].save(checkpointFileHandle)
+        if checkpointData["hasFinishedSubjects"]:
+            uboFinishedSubjects.save(checkpointFileHandle)
+        checkpointFileHandle.flush()
+        os.fsync(checkpointFileHandle.fileno())
+    os.replace(tempFileName, checkpointFile)
+    lastCheckpointTime = time.time()
+
+
+# ----------------------------------------
+def loadCheckpoint():
+    """restore the stats and caches saved by saveCheckpoint, returns where to carry on from"""
+    with open(checkpointFile, "rb") as checkpointFileHandle:
+        checkpointData = json.loads(checkpointFileHandle.readline())
+        if checkpointData["dnbFormat"] != dnbFormat or checkpointData["inputFiles"] != checkpointInputFiles:
+            raise ValueError("it was written for a different format or list of input files")
+        if checkpointData["hasParentDunsIndex"] != (parentDunsIndex is not None):
+            raise ValueError("it was written with a different --dedupe_parents setting")
+        if parentDunsIndex is not None:
+            parentDunsIndex.load(checkpointFileHandle)
+        ubo_company_cache["subject"].load(checkpointFileHandle)
+        ubo_company_cache["parent"].load(checkpointFileHandle)
+        finishedSubjects = None
+        if checkpointData["hasFinishedSubjects"]:
+            finishedSubjects = DunsIndex()
+            finishedSubjects.load(checkpointFileHandle)
+
+    statPack.update(checkpointData["statPack"])
+    for cat1, cat2, *sampleState in checkpointData["statExamples"]:
+        statExamples[(cat1, cat2)] = [set(statPack[cat1][cat2].get("examples", [])), *sampleState]
+    randomState = checkpointData["statRandom"]
+    statRandom.setstate((randomState[0], tuple(randomState[1]), randomState[2]))
+
+    # --run files spilled after the checkpoint hold rows that will be mapped again
+    if deltaRunDirectory:
+        for runFileName in os.listdir(deltaRunDirectory):
+            if runFileName not in checkpointData["deltaRunFiles"]:
+                os.remove(os.path.join(deltaRunDirectory, runFileName))
+
+    return {
+        "fileNum": checkpointData["fileNum"],
+        "rowCnt": checkpointData["rowCnt"],
+        "outputPosition": checkpointData["outputPosition"],
+        "uboDepthCache": {
+            subjectDuns: {int(depth): dunsList for depth, dunsList in depthChart.items()}
+            for subjectDuns, depthChart in checkpointData["uboDepthCache"].items()
+        },
+        "uboFinishedSubjects": finishedSubjects,
+    }
+
+
+# ----------------------------------------
+def saveUboCompanyCache(cacheFileName, uboCompanyCache):
+    """write the subject and parent DUNS already mapped so a later run can carry on from here"""
+    tempFileName = cacheFileName + ".tmp"
+    with open(tempFileName, "wb") as cacheFileHandle:
+        for cacheName in ("subject", "parent"):
+            uboCompanyCache[cacheName].save(cacheFileHandle)
+    os.replace(tempFileName, cacheFileName)
+
+
+# ----------------------------------------
+def loadUboCompanyCache(cacheFileName, uboCompanyCache):
+    with open(cacheFileName, "rb") as cacheFileHandle:
+        for cacheName in ("subject", "parent"):
+            uboCompanyCache[cacheName].load(cacheFileHandle)
+
+
+# ----------------------------------------
+def getInputSize(inputFileName):
+    """bytes of the file this run reads, just those of the --byte_range if there is one"""
+    fileSize = os.path.getsize(inputFileName)
+    if byteRange:
+        return max(min(byteRange[1], fileSize) - byteRange[0], 0)
+    return fileSize
+
+
+# ----------------------------------------
+def getInputPosition(inputFileHandle):
+    """bytes read so far from the file on disk, compressed files report their compressed bytes
+    and read ahead means it can be a buffer beyond the last row mapped"""
+    if isinstance(inputFileHandle, MappedLines):
+        filePos = inputFileHandle.filePos
+    else:
+        try:
+            filePos = os.lseek(inputFileHandle.fileno(), 0, os.SEEK_CUR)
+        except (OSError, AttributeError, io.UnsupportedOperation):
+            return 0
+    return max(filePos - byteRange[0], 0) if byteRange else filePos
+
+
+# ----------------------------------------
+def getResidentMemory():
+    """current resident memory of this process from /proc, or its peak where there is no /proc"""
+    try:
+        with open("/proc/self/statm", "r") as statmFile:
+            return int(statmFile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+
+        peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peakRss if sys.platform == "darwin" else peakRss * 1024
+    except ImportError:
+        return 0
+
+
+# ----------------------------------------
+def writeMetrics(rowCnt=0, badCnt=0, bytesRead=0, finished=False):
+    """rewrite the metrics file with the progress of the run, the rows, bad rows and bytes of the
+    current file are added to those of the files already mapped"""
+    global nextMetricsTime
+    nextMetricsTime = time.time() + metricsSeconds
+    elapsedSeconds = time.time() - procStartTime
+    bytesDone = runProgress["bytesRead"] + bytesRead
+    bytesThisRun = bytesDone - runProgress["bytesSkipped"]
+    etaSeconds = 0
+    if not finished and bytesThisRun > 0:
+        etaSeconds = elapsedSeconds / bytesThisRun * max(runProgress["bytesTotal"] - bytesDone, 0)
+    metricsData = {
+        "dnbFormat": dnbFormat,
+        "rowsRead": runProgress["rowsRead"] + rowCnt,
+        "badRows": runProgress["badRows"] + badCnt,
+        "recordsWritten": dict(recordsWritten),
+        "inputBytesRead": bytesDone,
+        "inputBytesTotal": runProgress["bytesTotal"],
+        "fileNumber": inputFileNum,
+        "fileCount": runProgress["fileCount"],
+        "elapsedSeconds": round(elapsedSeconds, 1),
+        "etaSeconds": round(etaSeconds, 1),
+        "residentMemoryBytes": getResidentMemory(),
+        "finished": finished,
+        "aborted": finished and bool(shutDown),
+        "updated": round(time.time(), 3),
+    }
+
+    if metricsFormat == "json":
+        metricsText = json.dumps(metricsData, indent=2) + "\n"
+    else:
+        metricsText = getPrometheusMetrics(metricsData)
+
+    # --a reader never sees a half written file
+    tempFileName = metricsFile + ".tmp"
+    try:
+        with open(tempFileName, "w", encoding="utf-8") as metricsFileHandle:
+            metricsFileHandle.write(metricsText)
+        os.replace(tempFileName, metricsFile)
+    except IOError as err:
+        print(f"warning: could not write the metrics to {metricsFile}: {err}")
+
+
+# ----------------------------------------
+def getPrometheusMetrics(metricsData):
+    """the metrics in the prometheus text format node_exporter's textfile collector reads"""
+    formatLabel = '{dnb_format="%s"}' % metricsData["dnbFormat"]
+    metricLines = []
+
+    def addMetric(metricName, metricType, helpText, metricValues):
+        """metricValues is a list of (labels, value) or a single value labelled with the format"""
+        if not isinstance(metricValues, list):
+            metricValues = [(formatLabel, metricValues)]
+        metricLines.append(f"# HELP dnb_mapper_{metricName} {helpText}")
+        metricLines.append(f"# TYPE dnb_mapper_{metricName} {metricType}")
+        for metricLabels, metricValue in metricValues:
+            metricLines.append(f"dnb_mapper_{metricName}{metricLabels} {metricValue}")
+
+    addMetric("rows_read_total", "counter", "Input rows read.", metricsData["rowsRead"])
+    addMetric("bad_rows_total", "counter", "Input rows that could not be mapped.", metricsData["badRows"])
+    addMetric(
+        "records_written_total",
+        "counter",
+        "Mapped records written by data source.",
+        [
+            ('{dnb_format="%s",data_source="%s"}' % (metricsData["dnbFormat"], dataSource), recordCount)
+            for dataSource, recordCount in sorted(metricsData["recordsWritten"].items())
+        ],
+    )
+    addMetric("input_bytes_read", "gauge", "Bytes of the input files read so far.", metricsData["inputBytesRead"])
+    addMetric("input_bytes_total", "gauge", "Bytes of all the input files.", metricsData["inputBytesTotal"])
+    addMetric("file_number", "gauge", "Number of the input file being mapped.", metricsData["fileNumber"])
+    addMetric("file_count", "gauge", "Number of input files.", metricsData["fileCount"])
+    addMetric("elapsed_seconds", "gauge", "Seconds since the run started.", metricsData["elapsedSeconds"])
+    addMetric("eta_seconds", "gauge", "Estimated seconds until the run finishes.", metricsData["etaSeconds"])
+    addMetric(
+        "resident_memory_bytes", "gauge", "Resident memory of the main process.", metricsData["residentMemoryBytes"]
+    )
+    addMetric("finished", "gauge", "1 once the run has finished.", int(metricsData["finished"]))
+    addMetric("aborted", "gauge", "1 if the run finished without mapping all its input.", int(metricsData["aborted"]))
+    addMetric("last_update_timestamp_seconds", "gauge", "When these metrics were written.", metricsData["updated"])
+    return "\n".join(metricLines) + "\n"
+
+
+# ----------------------------------------
+def getByteRanges(inputFileName, rangeCount):
+    """split a file into byte ranges that start on a line boundary without reading it through"""
+    fileSize = os.path.getsize(inputFileName)
+    boundaries = [0]
+    with open(inputFileName, "rb") as inputFileHandle:
+        for i in range(1, rangeCount):
+            inputFileHandle.seek(max(fileSize * i // rangeCount, boundaries[-1]))
+            inputFileHandle.readline()
+            if inputFileHandle.tell() >= fileSize:
+                break
+            if inputFileHandle.tell() > boundaries[-1]:
+                boundaries.append(inputFileHandle.tell())
+    boundaries.append(fileSize)
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+
+
+# ----------------------------------------
+def getUboSortKey(subjectIndex, depthIndex, row):
+    """subject duns without any file name prefix and the depth as a number, the same way format_UBO2 reads them"""
+    subjectDuns = row[subjectIndex] if len(row) > subjectIndex else ""
+    subjectDuns = subjectDuns[subjectDuns.find(":") + 1 :]
+    try:
+        depth = int(row[depthIndex]) if len(row) > depthIndex and row[depthIndex] else 1
+    except ValueError:
+        depth = 0
+    return subjectDuns, depth
+
+
+# ----------------------------------------
+def sortUboRows(inputFileReader):
+    columnIndex = schemaData["columnIndex"]
+    if "SUBJ_DUNS" not in columnIndex or "DEPTH" not in columnIndex:
+        print("\nwarning: the SUBJ_DUNS and DEPTH columns are needed to sort, mapping the rows as they are\n")
+        return inputFileReader
+    sortKey = functools.partial(getUboSortKey, columnIndex["SUBJ_DUNS"], columnIndex["DEPTH"])
+    return externalSort(inputFileReader, sortKey, sortMemoryMb * 1024 * 1024)
+
+
+# ----------------------------------------
+def externalSort(rows, sortKey, memoryBytes):
+    """yield the rows in sortKey order, rows with the same key stay in input order. Sorted runs of
+    about memoryBytes are spilled to temporary files and merged as the rows are read back."""
+    runFiles = []
+    runRows = []
+    runBytes = 0
+    try:
+        for rowNum, row in enumerate(rows):
+            runRows.append((*sortKey(row), rowNum, row))
+            runBytes += sum(len(value) for value in row) + 64 * len(row) + 200  # --rough size in memory
+            if runBytes >= memoryBytes:
+                runRows.sort()
+                runFile = tempfile.TemporaryFile("w+", encoding="utf-8", dir=sortTempDir)
+                runFiles.append(runFile)
+                for runRow in runRows:
+                    runFile.write(jsonDumps(runRow) + "\n")
+                runFile.seek(0)
+                runRows = []
+                runBytes = 0
+        runRows.sort()
+
+        if not runFiles:
+            for runRow in runRows:
+                yield runRow[-1]
+            return
+
+        print(f"\nMerging {len(runFiles) + 1} sorted runs\n")
+        runReaders = [(jsonLoads(line) for line in runFile) for runFile in runFiles]
+        runReaders.append(iter(runRows))
+        for runRow in heapq.merge(*runReaders, key=tuple):
+            yield runRow[-1]
+    finally:
+        for runFile in runFiles:
+            runFile.close()
+
+
+# ----------------------------------------
+def readBatches(inputFileReader, firstRowCnt=1):
+    batch = []
+    for row in inputFileReader:
+        batch.append(row)
+        if len(batch) == workerBatchSize:
+            yield firstRowCnt, batch
+            firstRowCnt += len(batch)
+            batch = []
+    if batch:
+        yield firstRowCnt, batch
+
+
+# ----------------------------------------
+def mapRowsInPool(pool, inputFileReader, firstRowCnt=1):
+    """yield the mapped rows in input order while keeping a bounded number of batches in flight"""
+    pendingBatches = collections.deque()
+    for batch in readBatches(inputFileReader, firstRowCnt):
+        pendingBatches.append(pool.apply_async(mapBatch, (batch,)))
+        if len(pendingBatches) >= workerCount * 2:
+            rowResults, workerStats = pendingBatches.popleft().get()
+            mergeStats(workerStats)
+            yield from rowResults
+    while pendingBatches:
+        rowResults, workerStats = pendingBatches.popleft().get()
+        mergeStats(workerStats)
+        yield from rowResults
+
+
 # ----------------------------------------
 def format_CMPCVF(rowData):
 
     jsonList = []
+    jsonKeys = set()  # --to de-dupe parents and principles without comparing against every prior record
 
     # --data corrections / updates
     rowData = rowData["organization"]
@@ -446,26 +1902,14 @@ def format_CMPCVF(rowData):
                 and rowData["corporateLinkage"][parentTag]["duns"] != thisDuns
             ):
                 rowData1 = rowData["corporateLinkage"][parentTag]
-                jsonData1 = {}
-                jsonData1["DATA_SOURCE"] = "DNB-PARENT"
-                jsonData1["RECORD_TYPE"] = "ORGANIZATION"
-                jsonData1["RECORD_ID"] = rowData1["duns"]
+                jsonData1, fullAddress, jsonKey = getParentRecord(rowData1)
                 updateStat("PARENT", parentTag)
-                jsonData1["DUNS_NUMBER"] = rowData1["duns"]
-                jsonData1["REL_ANCHOR_DOMAIN"] = "DUNS"
-                jsonData1["REL_ANCHOR_KEY"] = rowData1["duns"]
-                if "primaryName" in rowData1 and rowData1["primaryName"]:
-                    jsonData1["NAME_ORG"] = rowData1["primaryName"]
-                    updateStat("PARENT", parentTag, rowData1["primaryName"])
-                if "primaryAddress" in rowData1 and rowData1["primaryAddress"]:
-                    addrType = "PRIMARY"
-                    fullAddress, jsonAddr = mapJsonAddr(
-                        rowData1["primaryAddress"], addrType
-                    )
-                    if fullAddress:
-                        jsonData1.update(jsonAddr)
-                        updateStat("PARENT", "ADDRESS+" + addrType, fullAddress)
-                if jsonData1 not in jsonList:
+                if "NAME_ORG" in jsonData1:
+                    updateStat("PARENT", parentTag, jsonData1["NAME_ORG"])
+                if fullAddress:
+                    updateStat("PARENT", "ADDRESS+PRIMARY", fullAddress)
+                if jsonKey not in jsonKeys:
+                    jsonKeys.add(jsonKey)
                     jsonList.append(jsonData1)
 
                 relationship = {}
@@ -495,7 +1939,7 @@ def format_CMPCVF(rowData):
         fullName = rowData1.get("fullName")
         familyName = rowData1.get("familyName")
         if not fullName and not familyName:
-            updateStat(statCategory, "NO_NAME_SKIP", json.dumps(rowData1))
+            updateStat(statCategory, "NO_NAME_SKIP", jsonDumps(rowData1))
             continue
         principleCnt += 1
 
@@ -584,7 +2028,9 @@ def format_CMPCVF(rowData):
             updateStat(statCategory, "GROUP_ASSOCIATION_NAME", bestName)
 
         # --current and most senior principles overlap
-        if jsonData1 not in jsonList:
+        jsonKey = getRecordKey(jsonData1)
+        if jsonKey not in jsonKeys:
+            jsonKeys.add(jsonKey)
             jsonList.append(jsonData1)
 
     # --add the primary entity
@@ -593,6 +2039,50 @@ def format_CMPCVF(rowData):
     return jsonList
 
 
+# ----------------------------------------
+def getParentRecord(rowData1):
+    """map a parent from a corporate linkage, the same few parents are repeated on most rows so
+    recent ones are remembered, returns the record, its full address for stats and its record key"""
+    if parentCache is not None:
+        # --keyed on the duns alone, the name and address only need comparing on a hit
+        parentFingerprint = (rowData1.get("primaryName"), rowData1.get("primaryAddress"))
+        cachedParent = parentCache.get(rowData1["duns"], parentFingerprint)
+        if cachedParent:
+            return dict(cachedParent[0]), cachedParent[1], cachedParent[2]
+
+    jsonData1 = {}
+    jsonData1["DATA_SOURCE"] = "DNB-PARENT"
+    jsonData1["RECORD_TYPE"] = "ORGANIZATION"
+    jsonData1["RECORD_ID"] = rowData1["duns"]
+    jsonData1["DUNS_NUMBER"] = rowData1["duns"]
+    jsonData1["REL_ANCHOR_DOMAIN"] = "DUNS"
+    jsonData1["REL_ANCHOR_KEY"] = rowData1["duns"]
+    if "primaryName" in rowData1 and rowData1["primaryName"]:
+        jsonData1["NAME_ORG"] = rowData1["primaryName"]
+    fullAddress = ""
+    if "primaryAddress" in rowData1 and rowData1["primaryAddress"]:
+        fullAddress, jsonAddr = mapJsonAddr(rowData1["primaryAddress"], "PRIMARY")
+        if fullAddress:
+            jsonData1.update(jsonAddr)
+    jsonKey = getRecordKey(jsonData1)
+
+    if parentCache is not None:
+        parentCache.put(rowData1["duns"], (dict(jsonData1), fullAddress, jsonKey), parentFingerprint)
+    return jsonData1, fullAddress, jsonKey
+
+
+# ----------------------------------------
+def getRecordKey(jsonData):
+    """hashable key that two mapped records share only if they are equal, records
+    built by the same mapping code add their attributes in the same order"""
+    recordKey = tuple(jsonData.items())
+    try:
+        hash(recordKey)
+    except TypeError:  # --a nested list or dict value
+        return json.dumps(jsonData, sort_keys=True)
+    return recordKey
+
+
 # ----------------------------------------
 def mapJsonAddr(addrData, usageType, recordID=None):
     checkit = False
@@ -656,263 +2146,34 @@ def mapJsonAddr(addrData, usageType, recordID=None):
         jsonAddr[addrType + "ADDR_STATE"] = addrValue
         fullAddress = (fullAddress + " " + addrValue).strip()
 
-    if "postalCode" in addrData and addrData["postalCode"]:
-        addrValue = addrData["postalCode"]
-        jsonAddr[addrType + "ADDR_POSTAL_CODE"] = addrValue
-        fullAddress = (fullAddress + " " + addrValue).strip()
-
-    addrValue = ""
-    if (
-        "addressCountry" in addrData
-        and "isoAlpha2Code" in addrData["addressCountry"]
-        and addrData["addressCountry"]["isoAlpha2Code"]
-    ):
-        addrValue = addrData["addressCountry"]["isoAlpha2Code"]
-    elif (
-        "addressCountry" in addrData
-        and "name" in addrData["addressCountry"]
-        and addrData["addressCountry"]["name"]
-    ):
-        addrValue = addrData["addressCountry"]["name"]
-    if addrValue:
-        jsonAddr[addrType + "ADDR_COUNTRY"] = addrValue
-        fullAddress = (fullAddress + " " + addrValue).strip()
-
-    if checkit:
-        print(json.dumps(addrData, indent=4))
-        print("-" * 40)
-        print(json.dumps(jsonAddr, indent=4))
-
-    return fullAddress, jsonAddr
-
-
-# ----------------------------------------
-def format_GCA(rowData):
-
-    # --data corrections / updates
-    recordType = "PERSON"
-
-    # --json header
-    jsonData = {}
-    jsonData["DATA_SOURCE"] = "DNB-CONTACT"
-    jsonData["RECORD_ID"] = rowData["CONTACT_ID"]
-    jsonData["RECORD_TYPE"] = recordType
-
-    if rowData["INDIVIDUAL_ID"]:
-        jsonData["DNB_CONTACT_ID"] = rowData["INDIVIDUAL_ID"]
-        updateStat(recordType, "DNB_CONTACT_ID", rowData["INDIVIDUAL_ID"])
-
-    # --map the name
-    fullName = ""
-    if rowData["NAMEPREFIX"]:
-        jsonData["PRIMARY_NAME_PREFIX"] = rowData["NAMEPREFIX"]
-        fullName += " " + rowData["NAMEPREFIX"]
-    if rowData["FIRSTNAME"]:
-        jsonData["PRIMARY_NAME_FIRST"] = rowData["FIRSTNAME"]
-        fullName += " " + rowData["FIRSTNAME"]
-    if rowData["MIDDLENAME"]:
-        jsonData["PRIMARY_NAME_MIDDLE"] = rowData["MIDDLENAME"]
-        fullName += " " + rowData["MIDDLENAME"]
-    if rowData["LASTNAME"]:
-        jsonData["PRIMARY_NAME_LAST"] = rowData["LASTNAME"]
-        fullName += " " + rowData["LASTNAME"]
-    if rowData["NAMESUFFIX"]:
-        jsonData["PRIMARY_NAME_SUFFIX"] = rowData["NAMESUFFIX"]
-        fullName += " " + rowData["NAMESUFFIX"]
-    fullName = fullName.strip()
-    if fullName:
-        updateStat(recordType, "NAME-PRIMARY", fullName)
-
-    # --add an aka name
-    if rowData["GCA_NICKNAME"] and rowData["LASTNAME"]:
-        jsonData["AKA_NAME_FIRST"] = rowData["GCA_NICKNAME"]
-        jsonData["AKA_NAME_LAST"] = rowData["LASTNAME"]
-        updateStat(recordType, "NAME-AKA", fullName)
-
-    # --gender
-    if rowData["GCA_GENDER"]:
-        jsonData["GENDER"] = rowData["GCA_GENDER"]
-        updateStat(recordType, "GENDER", rowData["GCA_GENDER"])
-
-    # --map the address
-    fullAddress = ""
-    if rowData["GCA_STREETADDRESS1"]:
-        jsonData["PRIMARY_ADDR_LINE1"] = rowData["GCA_STREETADDRESS1"]
-        fullAddress += " " + rowData["GCA_STREETADDRESS1"]
-    if rowData["GCA_STREETADDRESS2"]:
-        jsonData["PRIMARY_ADDR_LINE2"] = rowData["GCA_STREETADDRESS2"]
-        fullAddress += " " + rowData["GCA_STREETADDRESS2"]
-    if rowData["GCA_CITYNAME"]:
-        jsonData["PRIMARY_ADDR_CITY"] = rowData["GCA_CITYNAME"]
-        fullAddress += " " + rowData["GCA_CITYNAME"]
-    if rowData["GCA_STATEPROVINCECODE"]:
-        jsonData["PRIMARY_ADDR_STATE"] = rowData["GCA_STATEPROVINCECODE"]
-        fullAddress += " " + rowData["GCA_STATEPROVINCECODE"]
-    if rowData["GCA_POSTALCODE"]:
-        jsonData["PRIMARY_ADDR_POSTAL_CODE"] = rowData["GCA_POSTALCODE"]
-        fullAddress += " " + rowData["GCA_POSTALCODE"]
-    if rowData["GCA_COUNTRYCODE"]:
-        jsonData["PRIMARY_ADDR_COUNTRY"] = rowData["GCA_COUNTRYCODE"]
-        fullAddress += " " + rowData["GCA_COUNTRYCODE"]
-    fullAddress = fullAddress.strip()
-    if fullAddress:
-        updateStat(recordType, "ADDRESS-PRIMARY", fullAddress)
-
-    # --phones and email
-    if rowData["PRIMARYPHONE"]:
-        jsonData["PRIMARY_PHONE_NUMBER"] = rowData["PRIMARYPHONE"]
-        updateStat(recordType, "PHONE-PRIMARY", rowData["PRIMARYPHONE"])
-        if rowData["PRIMARYPHONEEXTENSION"]:
-            jsonData["PRIMARY_PHONE_EXT"] = rowData["PRIMARYPHONEEXTENSION"]
-    if rowData["SECONDARYPHONE"]:
-        jsonData["SECONDARY_PHONE_NUMBER"] = rowData["SECONDARYPHONE"]
-        updateStat(recordType, "PHONE-SECONDARY", rowData["SECONDARYPHONE"])
-        if rowData["SECONDARYPHONEEXTENSION"]:
-            jsonData["SECONDARY_PHONE_EXT"] = rowData["SECONDARYPHONEEXTENSION"]
-    if rowData["EMAIL"]:
-        jsonData["EMAIL_ADDRESS"] = rowData["EMAIL"]
-        updateStat(recordType, "EMAIL_ADDRESS", rowData["EMAIL"])
-
-    # --relate them to the company they own and use their group association for matching
-    if rowData["DUNS_ID"]:
-        jsonData["REL_POINTER_DOMAIN"] = "DUNS"
-        jsonData["REL_POINTER_KEY"] = rowData["DUNS_ID"]
-        jsonData["REL_POINTER_ROLE"] = "Contact"
-        jsonData["GROUP_ASSN_ID_TYPE"] = "DUNS"
-        jsonData["GROUP_ASSN_ID_NUMBER"] = rowData["DUNS_ID"]
-        updateStat(recordType, "GROUP_ASSN_ID", rowData["DUNS_ID"])
-    if rowData["GCA_BUSINESSNAME"]:
-        jsonData["GROUP_ASSOCIATION_ORG_NAME"] = rowData["GCA_BUSINESSNAME"]
-        updateStat(recordType, "GROUP_ASSOCIATION_NAME", rowData["GCA_BUSINESSNAME"])
-
-    # --other info
-    if rowData["JOBTITLE"]:
-        jsonData["JOB_TITLE"] = rowData["JOBTITLE"]
-        updateStat(recordType, "JOB_TITLE", rowData["JOBTITLE"])
-
-    return [jsonData]  # --must return a list even though only 1
-
-
-# ----------------------------------------
-def format_UBO(rowData):
-
-    # --gotta filter for this ... sometimes there is no ownership in a company
-    # if not rowData['BENF_TYP_CD']:
-    #    return []
-
-    # --data corrections / updates
-    if (
-        ":" in rowData["SUBJ_DUNS"]
-    ):  # --sometimes they prepended file name to first column like this: UBO_00_0819.txt:021475652
-        rowData["SUBJ_DUNS"] = rowData["SUBJ_DUNS"][
-            rowData["SUBJ_DUNS"].find(":") + 1 :
-        ]
-
-    if rowData["BENF_TYP_CD"] == "119":
-        recordType = "PERSON"
-        nameAttribute = "NAME_FULL"
-        addressPrefix = ""
-    else:
-        recordType = "ORGANIZATION"
-        nameAttribute = "NAME_ORG"
-        addressPrefix = "BUSINESS_"
-
-    # --json header
-    jsonData = {}
-    jsonData["DATA_SOURCE"] = "DNB-OWNER"
-    if rowData["BENF_ID"]:
-        jsonData["RECORD_ID"] = "%s-%s" % (rowData["SUBJ_DUNS"], rowData["BENF_ID"])
-    jsonData["RECORD_TYPE"] = recordType
-    updateStat("INPUT", recordType)
-
-    jsonData[nameAttribute] = rowData["BENF_NME"]
-    updateStat(recordType, nameAttribute, rowData["BENF_NME"])
-
-    # --affiliate them to the subject country
-    if rowData["SUBJ_CTRY_CD"]:
-        jsonData["COUNTRY_OF_ASSOCIATION"] = rowData["SUBJ_CTRY_CD"]
-        updateStat(recordType, "COUNTRY_OF_ASSOCIATION", rowData["SUBJ_CTRY_CD"])
-
-    # --address
-    addressData = {}
-    addrFull = ""
-    if rowData["BENF_ADR_LN1"]:
-        addressData[addressPrefix + "ADDR_LINE1"] = rowData["BENF_ADR_LN1"]
-        addrFull += " " + rowData["BENF_ADR_LN1"]
-    if rowData["BENF_ADR_LN2"]:
-        addressData[addressPrefix + "ADDR_LINE2"] = rowData["BENF_ADR_LN2"]
-        addrFull += " " + rowData["BENF_ADR_LN2"]
-    if rowData["BENF_ADR_LN3"]:
-        addressData[addressPrefix + "ADDR_LINE3"] = rowData["BENF_ADR_LN3"]
-        addrFull += " " + rowData["BENF_ADR_LN3"]
-    if rowData["BENF_PRIM_TOWN"]:
-        addressData[addressPrefix + "ADDR_CITY"] = rowData["BENF_PRIM_TOWN"]
-        addrFull += " " + rowData["BENF_PRIM_TOWN"]
-    if rowData["BENF_CNTY"] or rowData["BENF_PROV_OR_ST"]:
-        addressData[addressPrefix + "ADDR_STATE"] = (
-            rowData["BENF_CNTY"] + " " + rowData["BENF_PROV_OR_ST"]
-        ).strip()
-        addrFull += (
-            " " + (rowData["BENF_CNTY"] + " " + rowData["BENF_PROV_OR_ST"]).strip()
-        )
-    if rowData["BENF_POST_CD"]:
-        addressData[addressPrefix + "ADDR_POSTAL_CODE"] = rowData["BENF_POST_CD"]
-        addrFull += " " + rowData["BENF_POST_CD"]
-    if rowData["BENF_CTRY_CD"]:
-        addressData[addressPrefix + "ADDR_COUNTRY"] = rowData["BENF_CTRY_CD"]
-        addrFull += " " + rowData["BENF_CTRY_CD"]
-    if addressData:
-        jsonData.update(addressData)
-        updateStat(recordType, "ADDRESS", addrFull.strip())
-
-    # --these are good identifiers
-    if rowData["BENF_DUNS"]:
-        jsonData["DUNS_NUMBER"] = rowData["BENF_DUNS"]
-        updateStat(recordType, "DUNS_NUMBER")
-    if rowData["BENF_ID"]:
-        jsonData["DNB_OWNER_ID"] = rowData["BENF_ID"]
-        updateStat(recordType, "DNB_OWNER_ID")
-
-    # --these aren't currently populated but maybe one day!
-    if rowData["NATY"]:
-        jsonData["NATIONALITY"] = rowData["NATY"]
-        updateStat(recordType, "NATIONALITY", rowData["NATY"])
-    if rowData["DT_OF_BRTH"]:
-        jsonData["DATE_OF_BIRTH"] = rowData["DT_OF_BRTH"]
-        updateStat(recordType, "DATE_OF_BIRTH", rowData["DT_OF_BRTH"])
+    if "postalCode" in addrData and addrData["postalCode"]:
+        addrValue = addrData["postalCode"]
+        jsonAddr[addrType + "ADDR_POSTAL_CODE"] = addrValue
+        fullAddress = (fullAddress + " " + addrValue).strip()
 
-    # --relate them to the company they own and use their group association for matching
-    if rowData["SUBJ_DUNS"]:
-        jsonData["REL_POINTER_DOMAIN"] = "DUNS"
-        jsonData["REL_POINTER_KEY"] = rowData["SUBJ_DUNS"]
-        jsonData["REL_POINTER_ROLE"] = "Owner"
-        jsonData["GROUP_ASSN_ID_TYPE"] = "DUNS"
-        jsonData["GROUP_ASSN_ID_NUMBER"] = rowData["SUBJ_DUNS"]
-        updateStat(recordType, "GROUP_ASSN_ID", rowData["SUBJ_DUNS"])
-    if rowData["SUBJ_NME"]:
-        jsonData["GROUP_ASSOCIATION_ORG_NAME"] = rowData["SUBJ_NME"]
-        updateStat(recordType, "GROUP_ASSOCIATION_NAME", rowData["SUBJ_NME"])
+    addrValue = ""
+    if (
+        "addressCountry" in addrData
+        and "isoAlpha2Code" in addrData["addressCountry"]
+        and addrData["addressCountry"]["isoAlpha2Code"]
+    ):
+        addrValue = addrData["addressCountry"]["isoAlpha2Code"]
+    elif (
+        "addressCountry" in addrData
+        and "name" in addrData["addressCountry"]
+        and addrData["addressCountry"]["name"]
+    ):
+        addrValue = addrData["addressCountry"]["name"]
+    if addrValue:
+        jsonAddr[addrType + "ADDR_COUNTRY"] = addrValue
+        fullAddress = (fullAddress + " " + addrValue).strip()
 
-    # --additional useful information
-    if rowData["BENF_LGL_FORM_DESC"]:
-        jsonData["LEGAL_FORM"] = rowData["BENF_LGL_FORM_DESC"]
-        updateStat(recordType, "LEGAL_FORM", rowData["BENF_LGL_FORM_DESC"])
-    if rowData["DIRC_OWRP_PCTG"]:
-        jsonData["DIRECT_OWNERSHIP_PERCENT"] = float(rowData["DIRC_OWRP_PCTG"])
-        updateStat(recordType, "DIRECT_OWNERSHIP_PERCENT", rowData["DIRC_OWRP_PCTG"])
-        jsonData["REL_POINTER_ROLE"] += " %sD" % rowData["DIRC_OWRP_PCTG"]
-    if rowData["IDIR_OWRP_PCTG"]:
-        jsonData["INDIRECT_OWNERSHIP_PERCENT"] = float(rowData["IDIR_OWRP_PCTG"])
-        jsonData["REL_POINTER_ROLE"] += " %sI" % rowData["IDIR_OWRP_PCTG"]
-        updateStat(recordType, "INDIRECT_OWNERSHIP_PERCENT", rowData["IDIR_OWRP_PCTG"])
-    if rowData["BENF_OWRP_PCTG"]:
-        jsonData["BENEFICIAL_OWNERSHIP_PERCENT"] = float(rowData["BENF_OWRP_PCTG"])
-        jsonData["REL_POINTER_ROLE"] += " %sB" % rowData["BENF_OWRP_PCTG"]
-        updateStat(
-            recordType, "BENEFICIAL_OWNERSHIP_PERCENT", rowData["BENF_OWRP_PCTG"]
-        )
+    if checkit:
+        print(json.dumps(addrData, indent=4))
+        print("-" * 40)
+        print(json.dumps(jsonAddr, indent=4))
 
-    return [jsonData]  # --must return a list even though only 1
+    return fullAddress, jsonAddr
 
 
 # ----------------------------------------
@@ -1083,6 +2344,26 @@ def format_UBO2(rowData, ubo_depth_cache):
     return [jsonData], ubo_depth_cache  # --must return a list even though only 1
 
 
+# ----------------------------------------
+def evictFinishedSubjects(subjectDuns, ubo_depth_cache):
+    """the rows of a subject normally arrive together, so the depth chart of the previous subject
+    is dropped when a new one starts. If a finished subject shows up again its chart is already
+    gone and its owners could not be linked to the right level, so the run is stopped."""
+    global uboNotGrouped
+    if subjectDuns in ubo_depth_cache:
+        return ubo_depth_cache
+
+    for finishedDuns in ubo_depth_cache:
+        uboFinishedSubjects.add(finishedDuns)
+    ubo_depth_cache.clear()
+
+    if subjectDuns in uboFinishedSubjects:
+        print(f"\nThe rows of subject {subjectDuns} are not together, map this file with --ubo_sort instead\n")
+        updateStat("UBO_STREAMING", "SUBJECT_NOT_GROUPED", subjectDuns)
+        uboNotGrouped = True
+    return ubo_depth_cache
+
+
 # ----------------------------------------
 def format_UBO_SUBJECT(rowData, ubo_company_cache):
 
@@ -1095,15 +2376,14 @@ def format_UBO_SUBJECT(rowData, ubo_company_cache):
         ]
 
     if "subject" not in ubo_company_cache:
-        ubo_company_cache["subject"] = {}
+        ubo_company_cache["subject"] = DunsIndex()
     if "parent" not in ubo_company_cache:
-        ubo_company_cache["parent"] = {}
+        ubo_company_cache["parent"] = DunsIndex()
 
     # --bypass if already mapped
-    if rowData["SUBJ_DUNS"] in ubo_company_cache["subject"]:
+    if not ubo_company_cache["subject"].add(rowData["SUBJ_DUNS"]):
         updateStat("DUPLICATE", "SUBJECT_DUNS", rowData["SUBJ_DUNS"])
         return [], ubo_company_cache
-    ubo_company_cache["subject"][rowData["SUBJ_DUNS"]] = 1
 
     jsonList = []
 
@@ -1152,8 +2432,7 @@ def format_UBO_SUBJECT(rowData, ubo_company_cache):
     jsonData["RELATIONSHIP_LIST"] = relationshipList
     jsonList.append(jsonData)
 
-    if rowData["PRNT_DUNS"] and rowData["PRNT_DUNS"] not in ubo_company_cache["parent"]:
-        ubo_company_cache["parent"][rowData["PRNT_DUNS"]] = 1
+    if rowData["PRNT_DUNS"] and ubo_company_cache["parent"].add(rowData["PRNT_DUNS"]):
         jsonData = {}
         jsonData["DATA_SOURCE"] = "DNB-PARENT"
         jsonData["RECORD_ID"] = rowData["PRNT_DUNS"]
@@ -1165,11 +2444,7 @@ def format_UBO_SUBJECT(rowData, ubo_company_cache):
         updateStat("DATA_SOURCE", "DNB-PARENT")
         jsonList.append(jsonData)
 
-    if (
-        rowData["DOM_ULT_DUNS"]
-        and rowData["DOM_ULT_DUNS"] not in ubo_company_cache["parent"]
-    ):
-        ubo_company_cache["parent"][rowData["DOM_ULT_DUNS"]] = 1
+    if rowData["DOM_ULT_DUNS"] and ubo_company_cache["parent"].add(rowData["DOM_ULT_DUNS"]):
         jsonData = {}
         jsonData["DATA_SOURCE"] = "DNB-PARENT"
         jsonData["RECORD_ID"] = rowData["DOM_ULT_DUNS"]
@@ -1181,11 +2456,7 @@ def format_UBO_SUBJECT(rowData, ubo_company_cache):
         updateStat("DATA_SOURCE", "DNB-PARENT")
         jsonList.append(jsonData)
 
-    if (
-        rowData["GLBL_ULT_DUNS"]
-        and rowData["GLBL_ULT_DUNS"] not in ubo_company_cache["parent"]
-    ):
-        ubo_company_cache["parent"][rowData["GLBL_ULT_DUNS"]] = 1
+    if rowData["GLBL_ULT_DUNS"] and ubo_company_cache["parent"].add(rowData["GLBL_ULT_DUNS"]):
         jsonData = {}
         jsonData["DATA_SOURCE"] = "DNB-PARENT"
         jsonData["RECORD_ID"] = rowData["GLBL_ULT_DUNS"]
@@ -1217,31 +2488,164 @@ def signal_handler(signal, frame):
     print("USER INTERRUPT! Shutting down ... (please wait)")
     global shutDown
     shutDown = True
+    if stopEvent:
+        stopEvent.set()
     return
 
 
 # ----------------------------------------
-def updateStat(cat1, cat2, example=None):
-
-    if cat1 not in statPack:
-        statPack[cat1] = {}
-    if cat2 not in statPack[cat1]:
-        statPack[cat1][cat2] = {}
-        statPack[cat1][cat2]["count"] = 0
+def updateStatFull(cat1, cat2, example=None):
+    try:
+        statData = statPack[cat1][cat2]
+    except KeyError:
+        statData = statPack.setdefault(cat1, {}).setdefault(cat2, {"count": 0})
 
-    statPack[cat1][cat2]["count"] += 1
+    statData["count"] += 1
     if example:
-        if "examples" not in statPack[cat1][cat2]:
-            statPack[cat1][cat2]["examples"] = []
-        if example not in statPack[cat1][cat2]["examples"]:
-            if len(statPack[cat1][cat2]["examples"]) < 5:
-                statPack[cat1][cat2]["examples"].append(example)
-            else:
-                randomSampleI = random.randint(2, 4)
-                statPack[cat1][cat2]["examples"][randomSampleI] = example
+        # --reservoir sample of up to 5 examples, the set makes the duplicate check constant time
+        exampleSample = statExamples.get((cat1, cat2))
+        if exampleSample is None:
+            examples = statData.setdefault("examples", [])
+            exampleSample = statExamples[(cat1, cat2)] = [set(examples), len(examples), 0, 1.0]
+            if len(examples) == 5:
+                skipExamples(exampleSample)
+        if example not in exampleSample[0]:
+            exampleSample[1] += 1
+            if exampleSample[1] <= 5:
+                statData["examples"].append(example)
+                exampleSample[0].add(example)
+                if exampleSample[1] == 5:
+                    skipExamples(exampleSample)
+            elif exampleSample[1] == exampleSample[2]:
+                examples = statData["examples"]
+                randomSampleI = statRandom.randrange(5)
+                exampleSample[0].discard(examples[randomSampleI])
+                examples[randomSampleI] = example
+                exampleSample[0].add(example)
+                skipExamples(exampleSample)
+    return
+
+
+# ----------------------------------------
+def skipExamples(exampleSample):
+    """pick which later example replaces one in a full sample (algorithm L), so only the examples
+    that get kept cost a random draw"""
+    exampleSample[3] *= math.exp(math.log(statRandom.random() or sys.float_info.min) / 5)
+    skipCount = math.log(statRandom.random() or sys.float_info.min) / math.log1p(-exampleSample[3])
+    exampleSample[2] = exampleSample[1] + int(skipCount) + 1
+
+
+# ----------------------------------------
+def updateStatCounts(cat1, cat2, example=None):
+    try:
+        statPack[cat1][cat2]["count"] += 1
+    except KeyError:
+        statPack.setdefault(cat1, {})[cat2] = {"count": 1}
+    return
+
+
+# ----------------------------------------
+def updateStatOff(cat1, cat2, example=None):
     return
 
 
+# ----------------------------------------
+def setStatsLevel(level):
+    """point updateStat at the statistics level asked for: off, counts or full"""
+    global updateStat, statRandom
+    statRandom = random.Random(statsSeed)
+    updateStat = {"off": updateStatOff, "counts": updateStatCounts}.get(level, updateStatFull)
+
+
+# ----------------------------------------
+def resetStats():
+    global statPack, statExamples
+    statPack = {}
+    statExamples = {}
+
+
+updateStat = updateStatFull
+statsSeed = 1
+statsLevel = "full"
+
+
+# ----------------------------------------
+def setParentCache(maxSize):
+    global parentCache
+    parentCache = LruCache(maxSize) if maxSize > 0 else None
+
+
+parentCache = None
+recordMapper = None
+deltaIndex = None
+previousIndexFile = None
+deltaRunDirectory = None
+
+
+# ----------------------------------------
+def mergeStats(otherStatPack):
+    """fold the stats gathered by another process into this one's"""
+    for cat1 in otherStatPack:
+        if cat1 not in statPack:
+            statPack[cat1] = {}
+        for cat2 in otherStatPack[cat1]:
+            if cat2 not in statPack[cat1]:
+                statPack[cat1][cat2] = {}
+                statPack[cat1][cat2]["count"] = 0
+            statPack[cat1][cat2]["count"] += otherStatPack[cat1][cat2]["count"]
+            statExamples.pop((cat1, cat2), None)
+            if "histogram" in otherStatPack[cat1][cat2]:
+                stageData = statPack[cat1][cat2]
+                stageData["totalNs"] = stageData.get("totalNs", 0) + otherStatPack[cat1][cat2]["totalNs"]
+                stageData.setdefault("histogram", {})
+                for bucketLabel, bucketCount in otherStatPack[cat1][cat2]["histogram"].items():
+                    stageData["histogram"][bucketLabel] = stageData["histogram"].get(bucketLabel, 0) + bucketCount
+            for example in otherStatPack[cat1][cat2].get("examples", []):
+                if "examples" not in statPack[cat1][cat2]:
+                    statPack[cat1][cat2]["examples"] = []
+                if example not in statPack[cat1][cat2]["examples"] and len(statPack[cat1][cat2]["examples"]) < 5:
+                    statPack[cat1][cat2]["examples"].append(example)
+    return
+
+
+# ----------------------------------------
+def orjsonDumps(jsonData):
+    return jsonModule.dumps(jsonData).decode("utf-8")
+
+
+# ----------------------------------------
+def encodedJsonDumps(jsonData):
+    return jsonDumps(jsonData).encode("utf-8")
+
+
+# ----------------------------------------
+def setJsonBackend(backendName, compact):
+    """point jsonLoads and jsonDumps at the requested json library, auto picks the fastest one installed.
+    Mapped records are written with jsonDumpsBytes, which orjson does without going through a str."""
+    global jsonModule, jsonLoads, jsonDumps, jsonDumpsBytes
+    if backendName == "auto":
+        backendName = next((x for x in ("orjson", "ujson") if importlib.util.find_spec(x)), "json")
+    jsonModule = importlib.import_module(backendName)
+
+    # --the faster libraries only write compact json, the stdlib matches them byte for byte when compact
+    if backendName == "orjson":
+        jsonLoads = jsonModule.loads
+        jsonDumps = orjsonDumps
+        jsonDumpsBytes = jsonModule.dumps
+    elif backendName == "ujson":
+        jsonLoads = jsonModule.loads
+        jsonDumps = functools.partial(jsonModule.dumps, ensure_ascii=False, escape_forward_slashes=False)
+    else:
+        jsonLoads = json.loads
+        if compact:
+            jsonDumps = functools.partial(json.dumps, separators=(",", ":"), ensure_ascii=False)
+        else:
+            jsonDumps = json.dumps
+    if backendName != "orjson":
+        jsonDumpsBytes = encodedJsonDumps
+    return backendName
+
+
 # ----------------------------------------
 if __name__ == "__main__":
 
@@ -1249,28 +2653,14 @@ if __name__ == "__main__":
 
     global shutDown
     shutDown = False
+    stopEvent = None
     signal.signal(signal.SIGINT, signal_handler)
 
-    global statPack
-    statPack = {}
+    resetStats()
 
     procStartTime = time.time()
     progressInterval = 10000
 
-    # --load the dnb file formats
-    dnbFormatFile = appPath + os.path.sep + "dnb_formats.json"
-    print(f"\nFormats File: {dnbFormatFile}")
-
-    if not os.path.exists(dnbFormatFile):
-        print(f"\nFormat file missing: {dnbFormatFile}\n")
-        sys.exit(1)
-
-    try:
-        dnbFormats = json.load(open(dnbFormatFile, "r"))
-    except json.decoder.JSONDecodeError as err:
-        print(f"\nJSON error {err} in {dnbFormatFile}\n")
-        sys.exit(1)
-
     argparser = argparse.ArgumentParser()
     argparser.add_argument(
         "-f",
@@ -1291,7 +2681,7 @@ if __name__ == "__main__":
         "--output_path",
         default=os.getenv("output_path".upper(), None),
         type=str,
-        help="output directory or file name for mapped json records",
+        help="output directory or file name for mapped json records, - writes them to stdout",
     )
     argparser.add_argument(
         "-l",
@@ -1300,9 +2690,232 @@ if __name__ == "__main__":
         type=str,
         help="optional statistics filename (json format).",
     )
+    argparser.add_argument(
+        "-w",
+        "--workers",
+        default=os.getenv("workers".upper(), "1"),
+        type=int,
+        help="number of processes to map the rows of each file with, defaults to 1",
+    )
+    argparser.add_argument(
+        "--worker_batch_size",
+        default=1000,
+        type=int,
+        help="number of rows handed to a worker at a time, defaults to 1000",
+    )
+    argparser.add_argument(
+        "--byte_range",
+        default=os.getenv("byte_range".upper(), None),
+        type=str,
+        help="only map the json lines that start within start:end of the input file",
+    )
+    argparser.add_argument(
+        "--list_byte_ranges",
+        default=0,
+        type=int,
+        help="print this many line aligned start:end byte ranges for each input file and exit",
+    )
+    argparser.add_argument(
+        "--parallel_files",
+        default=os.getenv("parallel_files".upper(), "1"),
+        type=int,
+        help="number of input files to map at the same time when the output is a directory, defaults to 1",
+    )
+    argparser.add_argument(
+        "--json_backend",
+        default=os.getenv("json_backend".upper(), "auto"),
+        type=str.lower,
+        choices=["auto", "orjson", "ujson", "json"],
+        help="json library to parse and write with, "
+        "auto picks orjson or ujson if installed and they always write compact json",
+    )
+    argparser.add_argument(
+        "--compact_json",
+        action="store_true",
+        default=False,
+        help="write compact json with the standard library, identical to what orjson and ujson write",
+    )
+    argparser.add_argument(
+        "--output_batch_size",
+        default=os.getenv("output_batch_size".upper(), "1000"),
+        type=int,
+        help="number of mapped records handed to the output at a time, defaults to 1000",
+    )
+    argparser.add_argument(
+        "--output_shards",
+        default=os.getenv("output_shards".upper(), "1"),
+        type=int,
+        help="number of files to spread each output over by the duns each record belongs to, for parallel loaders",
+    )
+    argparser.add_argument(
+        "--compress",
+        default=os.getenv("compress".upper(), None),
+        type=str.lower,
+        choices=["gzip", "xz"],
+        help="compress the output files on a background thread, "
+        ".gz or .xz is added to output file names in a directory",
+    )
+    argparser.add_argument(
+        "--stats",
+        default=os.getenv("stats".upper(), "full"),
+        type=str.lower,
+        choices=["off", "counts", "full"],
+        help="statistics to gather: full counts and examples (default), counts only or none at all",
+    )
+    argparser.add_argument(
+        "--stage_timing",
+        default=os.getenv("stage_timing".upper(), "0"),
+        type=int,
+        help="time reading, parsing, mapping, stats, json writing and output for every nth row "
+        "and add them to the statistics, 0 turns this off (default)",
+    )
+    argparser.add_argument(
+        "--profile",
+        default=os.getenv("profile".upper(), None),
+        type=str,
+        help="file to save a cProfile of the main process to, "
+        "a report of the slowest functions is written next to it with .txt added",
+    )
+    argparser.add_argument(
+        "--dedupe_parents",
+        action="store_true",
+        default=False,
+        help="write each DNB-PARENT record only once across all the files of the run",
+    )
+    argparser.add_argument(
+        "--parent_cache_size",
+        default=os.getenv("parent_cache_size".upper(), "10000"),
+        type=int,
+        help="number of recently mapped CMPCVF parents to remember, 0 turns this off, defaults to 10000",
+    )
+    argparser.add_argument(
+        "--ubo_streaming",
+        action="store_true",
+        default=False,
+        help="drop the UBO_ALONE depth chart of each subject once its rows are mapped, "
+        "the rows of a subject must be together",
+    )
+    argparser.add_argument(
+        "--ubo_sort",
+        action="store_true",
+        default=False,
+        help="sort the UBO_ALONE rows by subject and depth before mapping them, this also turns on --ubo_streaming",
+    )
+    argparser.add_argument(
+        "--sort_memory_mb",
+        default=os.getenv("sort_memory_mb".upper(), "1024"),
+        type=int,
+        help="megabytes of rows or index entries to sort in memory before spilling them to a temporary file, "
+        "defaults to 1024",
+    )
+    argparser.add_argument(
+        "--sort_temp_dir",
+        default=os.getenv("sort_temp_dir".upper(), None),
+        type=str,
+        help="directory for the temporary files of --ubo_sort, defaults to the system temp directory",
+    )
+    argparser.add_argument(
+        "--previous_index",
+        default=os.getenv("previous_index".upper(), None),
+        type=str,
+        help="index of the records mapped by the previous run, "
+        "only new or changed records are written and the index is updated for the next run",
+    )
+    argparser.add_argument(
+        "--delete_file",
+        default=os.getenv("delete_file".upper(), None),
+        type=str,
+        help="file to write a delete record to for each company, principle, owner or contact in the --previous_index "
+        "that was not mapped this run, .gz or .xz is added with --compress",
+    )
+    argparser.add_argument(
+        "--checkpoint_file",
+        default=os.getenv("checkpoint_file".upper(), None),
+        type=str,
+        help="file to save the progress of the run to so it can be resumed, it is removed when the run completes",
+    )
+    argparser.add_argument(
+        "--checkpoint_minutes",
+        default=os.getenv("checkpoint_minutes".upper(), "10"),
+        type=float,
+        help="minutes between checkpoints, one is also saved after each file and when the run is interrupted, "
+        "defaults to 10",
+    )
+    argparser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="carry on from the --checkpoint_file of a run that was interrupted",
+    )
+    argparser.add_argument(
+        "--metrics_file",
+        default=os.getenv("metrics_file".upper(), None),
+        type=str,
+        help="file to rewrite with the progress of the run every --metrics_seconds, "
+        "for schedulers and node_exporter's textfile collector",
+    )
+    argparser.add_argument(
+        "--metrics_format",
+        default=os.getenv("metrics_format".upper(), None),
+        type=str.lower,
+        choices=["prometheus", "json"],
+        help="format of the --metrics_file, defaults to json if its name ends in .json and prometheus otherwise",
+    )
+    argparser.add_argument(
+        "--metrics_seconds",
+        default=os.getenv("metrics_seconds".upper(), "15"),
+        type=float,
+        help="seconds between rewrites of the --metrics_file, defaults to 15",
+    )
+    argparser.add_argument(
+        "--ubo_cache_file",
+        default=os.getenv("ubo_cache_file".upper(), None),
+        type=str,
+        help="file to load the UBO_ALONE subjects and parents already mapped from and save them to at the end",
+    )
     args = argparser.parse_args()
     outputFilePath = args.output_path
+    outputBatchSize = max(args.output_batch_size, 1)
+    outputShards = max(args.output_shards, 1)
+    timingSampleRate = max(args.stage_timing, 0)
+
+    # --records written to stdout are piped on, so everything else printed goes to stderr
+    if outputFilePath == "-":
+        sys.stdout = sys.stderr
+
+    # --load the dnb file formats
+    dnbFormatFile = appPath + os.path.sep + "dnb_formats.json"
+    print(f"\nFormats File: {dnbFormatFile}")
+
+    if not os.path.exists(dnbFormatFile):
+        print(f"\nFormat file missing: {dnbFormatFile}\n")
+        sys.exit(1)
+
+    try:
+        dnbFormats = json.load(open(dnbFormatFile, "r"))
+    except json.decoder.JSONDecodeError as err:
+        print(f"\nJSON error {err} in {dnbFormatFile}\n")
+        sys.exit(1)
+
     logFile = args.log_file
+    workerCount = max(args.workers, 1)
+    workerBatchSize = max(args.worker_batch_size, 1)
+    parallelFileCount = max(args.parallel_files, 1)
+    compactJson = args.compact_json
+    outputCompression = args.compress
+    statsLevel = args.stats
+    parentCacheSize = args.parent_cache_size
+    uboSort = args.ubo_sort
+    uboStreaming = args.ubo_streaming or uboSort
+    sortMemoryMb = max(args.sort_memory_mb, 1)
+    sortTempDir = args.sort_temp_dir
+
+    # --verify the json library
+    if args.json_backend != "auto" and not importlib.util.find_spec(args.json_backend):
+        print(f"\nThe {args.json_backend} library is not installed\n")
+        sys.exit(1)
+    jsonBackend = setJsonBackend(args.json_backend, compactJson)
+    print(f"JSON library: {jsonBackend}")
 
     # --verify dnb format code
     if not args.dnb_format:
@@ -1314,6 +2927,11 @@ if __name__ == "__main__":
         print(f"\nDNB format code {dnbFormat} not found in dnb_formats.json\n")
         sys.exit(1)
 
+    # --the ubo depth chart relies on seeing the rows of a subject in order
+    if workerCount > 1 and dnbFormat == "UBO_ALONE":
+        print(f"\nwarning: {dnbFormat} must be mapped in a single process, ignoring --workers\n")
+        workerCount = 1
+
     # --verify input files to process
     if not args.input_spec:
         print("\nPlease enter one or morefile(s) to process\n")
@@ -1324,43 +2942,267 @@ if __name__ == "__main__":
         print(f"\nNo files found matching {args.input_spec}\n")
         sys.exit(1)
 
+    # --byte ranges let one json lines file be spread over many processes or machines
+    inputSchema = dnbFormats["mappings"][dnbFormat]["inputSchema"]
+    if (args.byte_range or args.list_byte_ranges) and dnbFormats["schemas"][inputSchema]["fileType"].upper() != "JSON":
+        print(f"\nByte ranges are only supported for json files, not {dnbFormat}\n")
+        sys.exit(1)
+
+    if (args.byte_range or args.list_byte_ranges) and any(getCompression(x) for x in inputFileList):
+        print(f"\nByte ranges cannot be used on compressed files\n")
+        sys.exit(1)
+
+    if args.list_byte_ranges:
+        for inputFileName in sorted(inputFileList):
+            for startPos, endPos in getByteRanges(inputFileName, args.list_byte_ranges):
+                print(f"{inputFileName} {startPos}:{endPos}")
+        sys.exit(0)
+
+    byteRange = None
+    if args.byte_range:
+        if len(inputFileList) > 1:
+            print(f"\nA byte range can only be applied to a single input file\n")
+            sys.exit(1)
+        try:
+            startPos, endPos = args.byte_range.split(":")
+            byteRange = (int(startPos or 0), int(endPos) if endPos else os.path.getsize(inputFileList[0]))
+        except ValueError:
+            print(f"\nInvalid byte range {args.byte_range}, expected start:end\n")
+            sys.exit(1)
+
     # --open output if a single file was specified
     if not outputFilePath:
         print("\nPlease enter a directory or file to write the output files to\n")
         sys.exit(1)
 
+    # --checkpoints need the rows of each file to be written in order by this process
+    checkpointFile = args.checkpoint_file
+    checkpointMinutes = args.checkpoint_minutes
+    if args.resume and not (checkpointFile and os.path.exists(checkpointFile)):
+        print(f"\nThere is no --checkpoint_file to resume from\n")
+        sys.exit(1)
+    if checkpointFile and parallelFileCount > 1:
+        print(f"\nCheckpoints cannot be used with --parallel_files\n")
+        sys.exit(1)
+
+    # --the metrics follow the rows as this process maps or writes them
+    metricsFile = args.metrics_file
+    metricsFormat = args.metrics_format or ("json" if metricsFile and metricsFile.endswith(".json") else "prometheus")
+    metricsSeconds = args.metrics_seconds
+    if metricsFile and parallelFileCount > 1:
+        print(f"\nA --metrics_file cannot be used with --parallel_files\n")
+        sys.exit(1)
+    if outputFilePath == "-" and (checkpointFile or outputCompression or outputShards > 1):
+        print(f"\nCheckpoints, --compress and --output_shards cannot be used when writing to stdout\n")
+        sys.exit(1)
+
+    # --a resumed output file is reopened once the checkpoint is loaded
     outputIsFile = not os.path.isdir(outputFilePath)
     if outputIsFile:
-        try:
-            outputFileHandle = open(outputFilePath, "w", encoding="utf-8")
-        except IOError as err:
-            print(f"\nCould not open output file {outputFilePath} for writing: {err}\n")
-            sys.exit(1)
+        outputFileName = outputFilePath
+        if not args.resume:
+            try:
+                outputSink = openOutputSink(outputFilePath)
+            except IOError as err:
+                print(f"\nCould not open output file {outputFilePath} for writing: {err}\n")
+                sys.exit(1)
     else:
         if outputFilePath[-1] != os.path.sep:
             outputFilePath += os.path.sep
 
+    # --each parallel file needs its own output file and worker processes cannot have workers of their own
+    if parallelFileCount > 1 and outputIsFile:
+        print(f"\nThe output must be a directory to map files in parallel\n")
+        sys.exit(1)
+    if parallelFileCount > 1 and workerCount > 1:
+        print(f"\nPlease choose either --workers or --parallel_files, not both\n")
+        sys.exit(1)
+
+    # --parents are written once per run if asked, the index is shared when files are mapped in parallel
+    parentDunsIndex = DunsIndex(shared=parallelFileCount > 1) if args.dedupe_parents else None
+
+    # --ubo subjects and parents are written once per run and can be carried over to the next one,
+    # --other formats never add to them so they are left unshared and their bitmaps are never allocated
+    shareUboCache = parallelFileCount > 1 and dnbFormat == "UBO_ALONE"
+    ubo_company_cache = {
+        "subject": DunsIndex(shared=shareUboCache),
+        "parent": DunsIndex(shared=shareUboCache),
+    }
+    if uboSort and dnbFormat != "UBO_ALONE":
+        print(f"\nThe --ubo_sort argument only applies to UBO_ALONE\n")
+        sys.exit(1)
+    if args.ubo_cache_file and dnbFormat != "UBO_ALONE":
+        print(f"\nThe --ubo_cache_file argument only applies to UBO_ALONE\n")
+        sys.exit(1)
+    if args.ubo_cache_file and os.path.exists(args.ubo_cache_file):
+        try:
+            loadUboCompanyCache(args.ubo_cache_file, ubo_company_cache)
+        except (IOError, ValueError, EOFError) as err:
+            print(f"\nCould not load {args.ubo_cache_file}: {err}\n")
+            sys.exit(1)
+        print(f"Loaded the subjects and parents already mapped from {args.ubo_cache_file}")
+
+    # --only records that are new or changed since the previous run are written if asked
+    previousIndexFile = args.previous_index
+    deltaRunDirectory = None
+    if args.delete_file and not previousIndexFile:
+        print(f"\nThe --delete_file argument needs a --previous_index to compare to\n")
+        sys.exit(1)
+    deleteFileName = args.delete_file
+    if deleteFileName and outputCompression:
+        if not deleteFileName.endswith(outputCompressionExtensions[outputCompression]):
+            deleteFileName += outputCompressionExtensions[outputCompression]
+    if previousIndexFile:
+        try:
+            if checkpointFile:
+                # --the fingerprints spilled so far are kept with the checkpoint
+                deltaRunDirectory = checkpointFile + ".delta"
+                if not args.resume:
+                    shutil.rmtree(deltaRunDirectory, ignore_errors=True)
+                os.makedirs(deltaRunDirectory, exist_ok=True)
+            else:
+                deltaRunDirectory = tempfile.mkdtemp(prefix="dnb_delta_", dir=sortTempDir)
+            deltaIndex = DeltaIndex(previousIndexFile, deltaRunDirectory, sortMemoryMb * 1024 * 1024)
+        except (IOError, ValueError) as err:
+            print(f"\nCould not open {previousIndexFile}: {err}\n")
+            sys.exit(1)
+        print(f"Previous index: {previousIndexFile} with {len(deltaIndex.previousKeys)} records")
+
     # --initialize some stats
-    statPack = {}
+    resetStats()
+    setStatsLevel(statsLevel)
+    setParentCache(parentCacheSize)
+
+    checkpointInputFiles = sorted(inputFileList)
+    lastCheckpointTime = time.time()
+    resumeState = None
+    if args.resume:
+        try:
+            resumeState = loadCheckpoint()
+            if outputIsFile:
+                outputSink = openOutputSink(outputFilePath, resumeState["outputPosition"])
+        except (IOError, ValueError, EOFError, KeyError) as err:
+            print(f"\nCould not resume from {checkpointFile}: {err}\n")
+            sys.exit(1)
+        resumeFileNum = resumeState["fileNum"]
+        print(f"Resuming at row {resumeState['rowCnt']} of file {resumeFileNum + 1} from {checkpointFile}")
+        # --a checkpoint between files starts the next one afresh
+        if not resumeState["rowCnt"]:
+            resumeState = None
+    else:
+        resumeFileNum = 0
 
-    # --for each input file
+    runProgress["fileCount"] = len(inputFileList)
+    if metricsFile:
+        runProgress["bytesTotal"] = sum(getInputSize(inputFileName) for inputFileName in inputFileList)
+
+    # --only the main process is profiled, worker processes show up as time spent waiting on them
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # --map several files at once, each one to its own output file
     inputFileNum = 0
-    for inputFileName in sorted(inputFileList):
-        inputFileNum += 1
-        fileDisplay = f"Processing file {inputFileNum} of {len(inputFileList)} - {inputFileName}...\n"
-        print(f"\n" + "-" * len(fileDisplay))
-        print(fileDisplay)
+    if parallelFileCount > 1:
+        stopEvent = multiprocessing.Event()
+        with multiprocessing.Pool(
+            min(parallelFileCount, len(inputFileList)),
+            initFileWorker,
+            (getWorkerSettings(), stopEvent, parentDunsIndex, ubo_company_cache),
+        ) as pool:
+            for fileProcessed, fileShutDown, fileStats in pool.imap_unordered(
+                processFileInWorker, sorted(inputFileList)
+            ):
+                inputFileNum += 1 if fileProcessed else 0
+                mergeStats(fileStats)
+                if fileShutDown:
+                    shutDown = True
+                    stopEvent.set()
 
-        shutDown = processFile(inputFileName)
-        if shutDown:
-            break
+    # --for each input file
+    else:
+        if metricsFile:
+            writeMetrics()
+        for inputFileName in sorted(inputFileList):
+            inputFileNum += 1
+            if inputFileNum <= resumeFileNum:
+                if metricsFile:
+                    runProgress["bytesRead"] += getInputSize(inputFileName)
+                    runProgress["bytesSkipped"] += getInputSize(inputFileName)
+                continue
+            fileDisplay = f"Processing file {inputFileNum} of {len(inputFileList)} - {inputFileName}...\n"
+            print(f"\n" + "-" * len(fileDisplay))
+            print(fileDisplay)
+
+            shutDown = processFile(inputFileName)
+            if shutDown:
+                break
+            if checkpointFile:
+                try:
+                    saveCheckpoint(inputFileNum, 0, outputSink if outputIsFile else None)
+                except IOError as err:
+                    print(f"\nCould not write the checkpoint to {checkpointFile}: {err}\n")
+                    shutDown = True
+                    break
 
     print(f"\n{inputFileNum} of {len(inputFileList)} files processed")
 
+    if profiler:
+        profiler.disable()
+        try:
+            profiler.dump_stats(args.profile)
+            with open(args.profile + ".txt", "w") as profileReport:
+                pstats.Stats(profiler, stream=profileReport).sort_stats("cumulative").print_stats(50)
+            print(f"\nProfile written to {args.profile}, the slowest functions are in {args.profile}.txt")
+        except IOError as err:
+            print(f"\nCould not write the profile to {args.profile}: {err}\n")
+
     if outputIsFile:
-        outputFileHandle.close()
+        try:
+            outputSink.close()
+        except IOError as err:
+            print(f"\nCould not write to {outputFilePath}: {err}\n")
+            shutDown = True
+
+    # --a run that did not finish would leave records out of the index
+    if deltaRunDirectory:
+        if shutDown:
+            print(f"\nThe run did not finish, {previousIndexFile} was not updated and no deletes were written")
+        else:
+            try:
+                recordCount, deleteCount = finishDeltaIndex(previousIndexFile, deltaRunDirectory, deleteFileName)
+                print(f"\n{recordCount} records indexed in {previousIndexFile} for the next run")
+                if deleteFileName:
+                    print(f"{deleteCount} delete records written to {deleteFileName}")
+            except IOError as err:
+                print(f"\nCould not write {previousIndexFile}: {err}\n")
+                shutDown = True
+        if not (checkpointFile and shutDown):
+            shutil.rmtree(deltaRunDirectory, ignore_errors=True)
+
+    # --the subjects of a run that did not finish were not all written, a checkpoint keeps them for a resume
+    if args.ubo_cache_file and shutDown:
+        print(f"\nThe run did not finish, {args.ubo_cache_file} was not updated")
+    elif args.ubo_cache_file:
+        try:
+            saveUboCompanyCache(args.ubo_cache_file, ubo_company_cache)
+            print(f"\nThe subjects and parents mapped were saved to {args.ubo_cache_file}")
+        except IOError as err:
+            print(f"\nCould not write {args.ubo_cache_file}: {err}\n")
+            shutDown = True
+
+    if checkpointFile:
+        if shutDown and os.path.exists(checkpointFile) and not uboNotGrouped:
+            print(f"\nRun again with --resume to carry on from {checkpointFile}")
+        elif os.path.exists(checkpointFile):
+            os.remove(checkpointFile)
+
+    if metricsFile:
+        writeMetrics(finished=True)
+        print(f"\nFinal metrics written to {metricsFile}")
 
-    # --write statistics file
+    # --write statistics file, always with the stdlib so it looks the same whichever json library is installed
     if logFile:
         with open(logFile, "w") as outfile:
             json.dump(statPack, outfile, indent=4, sort_keys=True)
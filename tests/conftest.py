@@ -0,0 +1,46 @@
+import gzip
+import os
+import subprocess
+import sys
+
+import pytest
+
+srcPath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, srcPath)
+
+import dnb_generator  # noqa: E402  pylint: disable=wrong-import-position
+
+
+# ----------------------------------------
+def runMapper(*mapperArgs):
+    """run the mapper the way a user would, returns the completed process with its output as text"""
+    return subprocess.run(
+        [sys.executable, os.path.join(srcPath, "dnb_mapper.py"), *[str(x) for x in mapperArgs]],
+        capture_output=True,
+        text=True,
+        check=False,
+        timeout=300,
+    )
+
+
+# ----------------------------------------
+def readJsonLines(fileName):
+    """the records of a json lines file, decompressed if need be"""
+    if fileName.endswith(".gz"):
+        with gzip.open(fileName, "rt", encoding="utf-8") as fileHandle:
+            return [x for x in fileHandle.read().split("\n") if x]
+    with open(fileName, "r", encoding="utf-8") as fileHandle:
+        return [x for x in fileHandle.read().split("\n") if x]
+
+
+# ----------------------------------------
+@pytest.fixture(name="generatedFile")
+def fixtureGeneratedFile(tmp_path):
+    """makes up a file of dnb rows in tmp_path, the same arguments always make the same file"""
+
+    def generateFile(dnbFormat, rowCount, seed=1, fileName=None):
+        inputFileName = str(tmp_path / (fileName or f"{dnbFormat.lower()}_{rowCount}_{seed}.txt"))
+        dnb_generator.generateFile(dnbFormat, inputFileName, rowCount, seed)
+        return inputFileName
+
+    return generateFile
@@ -0,0 +1,55 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from conftest import runMapper, srcPath
+
+
+# ----------------------------------------
+def readStats(logFileName):
+    """the statistics of a run, less the parent cache ones that start over on a resume"""
+    with open(logFileName, "r", encoding="utf-8") as logFileHandle:
+        statData = json.load(logFileHandle)
+    statData.pop("PARENT_CACHE", None)
+    return statData
+
+
+# ----------------------------------------
+def test_resume_after_interrupt(tmp_path, generatedFile):
+    """a run interrupted part way through and resumed writes the same records and stats as one that was not"""
+    inputFileName = generatedFile("CMPCVF", 3000)
+    fullRun = runMapper("-f", "CMPCVF", "-i", inputFileName, "-o", tmp_path / "full.json", "-l", tmp_path / "full.log")
+    assert fullRun.returncode == 0, fullRun.stderr
+
+    # --a checkpoint after every row, the run is interrupted once the first one is saved
+    checkpointFile = tmp_path / "cmpcvf.checkpoint"
+    mapperArgs = ["-f", "CMPCVF", "-i", inputFileName, "-o", tmp_path / "resumed.json", "-l", tmp_path / "resumed.log"]
+    mapperArgs += ["--checkpoint_file", checkpointFile, "--checkpoint_minutes", "0"]
+    mapperProcess = subprocess.Popen(
+        [sys.executable, os.path.join(srcPath, "dnb_mapper.py"), *[str(x) for x in mapperArgs]],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    while not checkpointFile.exists() and mapperProcess.poll() is None:
+        time.sleep(0.01)
+    mapperProcess.send_signal(signal.SIGINT)
+    interruptedOutput, interruptedErrors = mapperProcess.communicate(timeout=300)
+    assert mapperProcess.returncode == 0, interruptedErrors
+    assert "Run again with --resume" in interruptedOutput
+
+    with open(checkpointFile, "rb") as checkpointFileHandle:
+        interruptedRows = json.loads(checkpointFileHandle.readline())["rowCnt"]
+    assert 0 < interruptedRows < 3000
+
+    resumedRun = runMapper(*mapperArgs, "--resume")
+    assert resumedRun.returncode == 0, resumedRun.stderr
+    assert f"Resuming at row {interruptedRows} of file 1" in resumedRun.stdout
+    assert not checkpointFile.exists()
+
+    with open(tmp_path / "full.json", "rb") as fullFileHandle, open(tmp_path / "resumed.json", "rb") as resumedHandle:
+        assert resumedHandle.read() == fullFileHandle.read()
+    assert readStats(tmp_path / "resumed.log") == readStats(tmp_path / "full.log")
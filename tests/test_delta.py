@@ -0,0 +1,145 @@
+import json
+import os
+
+from conftest import readJsonLines, runMapper
+
+
+# ----------------------------------------
+def test_delete_file_after_delta_run(tmp_path, generatedFile):
+    """a second run over fewer rows writes a delete for each company that is gone and a new index"""
+    firstFile = generatedFile("CMPCVF", 60)
+    with open(firstFile, "r", encoding="latin1") as inputFileHandle:
+        inputRows = inputFileHandle.readlines()
+    secondFile = str(tmp_path / "cmpcvf_second.txt")
+    with open(secondFile, "w", encoding="latin1") as outputFileHandle:
+        outputFileHandle.writelines(inputRows[:40])
+    goneDuns = {json.loads(row)["organization"]["duns"] for row in inputRows[40:]}
+
+    indexFile = str(tmp_path / "cmpcvf.idx")
+    sortTempDir = tmp_path / "sort"
+    sortTempDir.mkdir()
+    firstRun = runMapper("-f", "CMPCVF", "-i", firstFile, "-o", tmp_path / "first.json", "--previous_index", indexFile)
+    assert firstRun.returncode == 0, firstRun.stderr
+
+    deleteFile = str(tmp_path / "deletes.json")
+    secondRun = runMapper(
+        "-f",
+        "CMPCVF",
+        "-i",
+        secondFile,
+        "-o",
+        tmp_path / "second.json",
+        "--previous_index",
+        indexFile,
+        "--delete_file",
+        deleteFile,
+        "--sort_temp_dir",
+        sortTempDir,
+    )
+    assert secondRun.returncode == 0, secondRun.stderr
+    assert "delete records written" in secondRun.stdout
+
+    deleteRecords = [json.loads(x) for x in readJsonLines(deleteFile)]
+    deletedCompanies = {x["RECORD_ID"] for x in deleteRecords if x["DATA_SOURCE"] == "DNB-COMPANY"}
+    assert deletedCompanies == goneDuns
+    assert not readJsonLines(str(tmp_path / "second.json"))
+    assert not os.listdir(sortTempDir)
+
+    # --the index now holds just the second run, so the companies that were deleted are new again
+    thirdRun = runMapper("-f", "CMPCVF", "-i", firstFile, "-o", tmp_path / "third.json", "--previous_index", indexFile)
+    assert thirdRun.returncode == 0, thirdRun.stderr
+    thirdRecords = [json.loads(x) for x in readJsonLines(str(tmp_path / "third.json"))]
+    thirdCompanies = {x["RECORD_ID"] for x in thirdRecords if x["DATA_SOURCE"] == "DNB-COMPANY"}
+    assert thirdCompanies == goneDuns
+
+
+# ----------------------------------------
+def renameCompany(inputRow):
+    """the same company row with a different name"""
+    rowData = json.loads(inputRow)
+    rowData["organization"]["primaryName"] += " Renamed"
+    return json.dumps(rowData) + "\n"
+
+
+# ----------------------------------------
+def companyIds(outputFileName):
+    jsonRecords = [json.loads(x) for x in readJsonLines(outputFileName)]
+    return {x["RECORD_ID"] for x in jsonRecords if x["DATA_SOURCE"] == "DNB-COMPANY"}
+
+
+# ----------------------------------------
+def test_delta_new_changed_unchanged_and_deleted_records(tmp_path, generatedFile):
+    """only new and changed records are written, gone ones are deleted and a record mapped twice keeps its last json"""
+    with open(generatedFile("CMPCVF", 60), "r", encoding="latin1") as inputFileHandle:
+        inputRows = inputFileHandle.readlines()
+    rowDuns = [json.loads(row)["organization"]["duns"] for row in inputRows]
+
+    def writeRows(fileName, rowList):
+        with open(tmp_path / fileName, "w", encoding="latin1") as outputFileHandle:
+            outputFileHandle.writelines(rowList)
+        return str(tmp_path / fileName)
+
+    def mapDelta(inputFileName, outputFileName, *mapperArgs):
+        mapperRun = runMapper(
+            "-f",
+            "CMPCVF",
+            "-i",
+            inputFileName,
+            "-o",
+            tmp_path / outputFileName,
+            "--previous_index",
+            indexFile,
+            *mapperArgs,
+        )
+        assert mapperRun.returncode == 0, mapperRun.stderr
+        return str(tmp_path / outputFileName)
+
+    # --rows 0-9 stay the same, 10-19 change, 20-39 are gone and 40-59 are new, 50-59 twice with a new name last
+    indexFile = str(tmp_path / "cmpcvf.idx")
+    firstOutput = mapDelta(writeRows("first.txt", inputRows[:40]), "first.json")
+    assert companyIds(firstOutput) == set(rowDuns[:40])
+
+    changedRows = [renameCompany(row) for row in inputRows[10:20]]
+    renamedRows = [renameCompany(row) for row in inputRows[50:60]]
+    secondFile = writeRows("second.txt", inputRows[:10] + changedRows + inputRows[40:60] + renamedRows)
+    deleteFile = str(tmp_path / "deletes.json")
+    secondOutput = mapDelta(secondFile, "second.json", "--delete_file", deleteFile)
+    assert companyIds(secondOutput) == set(rowDuns[10:20] + rowDuns[40:60])
+    assert companyIds(deleteFile) == set(rowDuns[20:40])
+
+    # --mapping the records as they were last written changes nothing
+    thirdFile = writeRows("third.txt", inputRows[:10] + changedRows + inputRows[40:50] + renamedRows)
+    assert not readJsonLines(mapDelta(thirdFile, "third.json", "--delete_file", deleteFile))
+    assert not readJsonLines(deleteFile)
+
+
+# ----------------------------------------
+def test_compressed_delete_file(tmp_path, generatedFile):
+    inputFileName = generatedFile("CMPCVF", 20)
+    indexFile = str(tmp_path / "cmpcvf.idx")
+    firstRun = runMapper(
+        "-f", "CMPCVF", "-i", inputFileName, "-o", tmp_path / "first.json", "--previous_index", indexFile
+    )
+    assert firstRun.returncode == 0, firstRun.stderr
+
+    emptyFile = str(tmp_path / "empty.txt")
+    open(emptyFile, "w", encoding="utf-8").close()
+    deleteFile = str(tmp_path / "deletes.json")
+    secondRun = runMapper(
+        "-f",
+        "CMPCVF",
+        "-i",
+        emptyFile,
+        "-o",
+        tmp_path / "second.json",
+        "--previous_index",
+        indexFile,
+        "--delete_file",
+        deleteFile,
+        "--compress",
+        "gzip",
+    )
+    assert secondRun.returncode == 0, secondRun.stderr
+    assert f"delete records written to {deleteFile}.gz" in secondRun.stdout
+    assert not os.path.exists(deleteFile)
+    assert companyIds(deleteFile + ".gz") == companyIds(str(tmp_path / "first.json"))
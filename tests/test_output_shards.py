@@ -0,0 +1,37 @@
+import collections
+import json
+
+import pytest
+
+from conftest import readJsonLines, runMapper
+
+
+# ----------------------------------------
+def getOrganization(jsonData):
+    """the duns of the company a record belongs to, parents are shared by many so they have none"""
+    if jsonData["DATA_SOURCE"] == "DNB-PARENT":
+        return None
+    if jsonData["DATA_SOURCE"] == "DNB-COMPANY":
+        return jsonData["RECORD_ID"]
+    if jsonData["DATA_SOURCE"] == "DNB-OWNER":
+        return jsonData["RECORD_ID"].split("-")[0]
+    return jsonData.get("REL_POINTER_KEY")
+
+
+# ----------------------------------------
+@pytest.mark.parametrize("dnbFormat, inputFormat", [("CMPCVF", "CMPCVF"), ("GCA", "GCA"), ("UBO_ALONE", "UBO")])
+def test_shards_hold_whole_organizations(dnbFormat, inputFormat, tmp_path, generatedFile):
+    mapperRun = runMapper(
+        "-f", dnbFormat, "-i", generatedFile(inputFormat, 300), "-o", tmp_path / "output.json", "--output_shards", 4
+    )
+    assert mapperRun.returncode == 0, mapperRun.stderr
+
+    organizationShards = collections.defaultdict(set)
+    for shardNum in range(4):
+        for jsonLine in readJsonLines(str(tmp_path / f"output.{shardNum}.json")):
+            organization = getOrganization(json.loads(jsonLine))
+            if organization:
+                organizationShards[organization].add(shardNum)
+    assert len(organizationShards) > 10
+    assert len(set().union(*organizationShards.values())) == 4
+    assert {x for x, shardNums in organizationShards.items() if len(shardNums) > 1} == set()
@@ -0,0 +1,49 @@
+import contextlib
+import json
+
+import pytest
+
+import dnb_benchmark
+import dnb_mapper
+
+
+# ----------------------------------------
+def test_output_sink_needs_write_batch():
+    class IncompleteSink(dnb_mapper.OutputSink):  # pylint: disable=abstract-method
+        """a sink without the writeBatch every sink needs"""
+
+    with pytest.raises(TypeError):
+        IncompleteSink(10)  # pylint: disable=abstract-class-instantiated
+
+
+# ----------------------------------------
+def mapFile(dnbFormat, inputFileName, outputSink):
+    """map a file in this process the way main does, with the records going to outputSink"""
+    dnb_benchmark.setUpMapper(dnbFormat, "json")
+    dnb_mapper.resumeState = None
+    dnb_mapper.outputIsFile = True
+    dnb_mapper.outputFileName = None
+    dnb_mapper.outputSink = outputSink
+    with contextlib.redirect_stdout(None):
+        dnb_mapper.processFile(inputFileName)
+        outputSink.close()
+
+
+# ----------------------------------------
+@pytest.mark.parametrize("dnbFormat", ["CMPCVF", "GCA"])
+def test_callback_sink_in_place_of_loader(dnbFormat, generatedFile, tmp_path):
+    inputFileName = generatedFile(dnbFormat, 250)
+    outputFileName = str(tmp_path / "mapped.json")
+    mapFile(dnbFormat, inputFileName, dnb_mapper.FileSink(outputFileName, 100))
+
+    # --a stand-in loader gets the same records in batches
+    recordBatches = []
+    mapFile(dnbFormat, inputFileName, dnb_mapper.CallbackSink(recordBatches.append, 100))
+
+    assert recordBatches and all(0 < len(recordBatch) <= 100 for recordBatch in recordBatches)
+    loadedRecords = [record for recordBatch in recordBatches for record in recordBatch]
+    for dataSource, recordID, msg in loadedRecords:
+        jsonData = json.loads(msg)
+        assert (jsonData["DATA_SOURCE"], jsonData.get("RECORD_ID")) == (dataSource, recordID)
+    with open(outputFileName, "rb") as outputFileHandle:
+        assert b"".join(msg + b"\n" for _, _, msg in loadedRecords) == outputFileHandle.read()
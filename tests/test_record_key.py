@@ -0,0 +1,10 @@
+import dnb_mapper
+
+
+# ----------------------------------------
+def test_record_key_of_nested_values():
+    """records with list or dict values still get a key that can go in a set"""
+    recordKeys = {dnb_mapper.getRecordKey({"NAME_ORG": "Acme", "RELATIONSHIPS": [{"REL_POINTER_KEY": "1"}]})}
+    assert dnb_mapper.getRecordKey({"RELATIONSHIPS": [{"REL_POINTER_KEY": "1"}], "NAME_ORG": "Acme"}) in recordKeys
+    assert dnb_mapper.getRecordKey({"NAME_ORG": "Acme", "RELATIONSHIPS": []}) not in recordKeys
+    assert dnb_mapper.getRecordKey({"NAME_ORG": "Acme"}) == (("NAME_ORG", "Acme"),)
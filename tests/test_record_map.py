@@ -0,0 +1,259 @@
+# pylint: disable=duplicate-code
+import contextlib
+
+import pytest
+
+import dnb_benchmark
+import dnb_mapper
+
+referenceStats = []
+
+
+# ----------------------------------------
+def updateStat(cat1, cat2, example=None):
+    referenceStats.append((cat1, cat2, example))
+
+
+# ----------------------------------------
+# --the hand written mappings the GCA and UBO recordMaps replaced, the generated mappers must do the same
+def format_GCA(rowData):
+
+    # --data corrections / updates
+    recordType = "PERSON"
+
+    # --json header
+    jsonData = {}
+    jsonData["DATA_SOURCE"] = "DNB-CONTACT"
+    jsonData["RECORD_ID"] = rowData["CONTACT_ID"]
+    jsonData["RECORD_TYPE"] = recordType
+
+    if rowData["INDIVIDUAL_ID"]:
+        jsonData["DNB_CONTACT_ID"] = rowData["INDIVIDUAL_ID"]
+        updateStat(recordType, "DNB_CONTACT_ID", rowData["INDIVIDUAL_ID"])
+
+    # --map the name
+    fullName = ""
+    if rowData["NAMEPREFIX"]:
+        jsonData["PRIMARY_NAME_PREFIX"] = rowData["NAMEPREFIX"]
+        fullName += " " + rowData["NAMEPREFIX"]
+    if rowData["FIRSTNAME"]:
+        jsonData["PRIMARY_NAME_FIRST"] = rowData["FIRSTNAME"]
+        fullName += " " + rowData["FIRSTNAME"]
+    if rowData["MIDDLENAME"]:
+        jsonData["PRIMARY_NAME_MIDDLE"] = rowData["MIDDLENAME"]
+        fullName += " " + rowData["MIDDLENAME"]
+    if rowData["LASTNAME"]:
+        jsonData["PRIMARY_NAME_LAST"] = rowData["LASTNAME"]
+        fullName += " " + rowData["LASTNAME"]
+    if rowData["NAMESUFFIX"]:
+        jsonData["PRIMARY_NAME_SUFFIX"] = rowData["NAMESUFFIX"]
+        fullName += " " + rowData["NAMESUFFIX"]
+    fullName = fullName.strip()
+    if fullName:
+        updateStat(recordType, "NAME-PRIMARY", fullName)
+
+    # --add an aka name
+    if rowData["GCA_NICKNAME"] and rowData["LASTNAME"]:
+        jsonData["AKA_NAME_FIRST"] = rowData["GCA_NICKNAME"]
+        jsonData["AKA_NAME_LAST"] = rowData["LASTNAME"]
+        updateStat(recordType, "NAME-AKA", fullName)
+
+    # --gender
+    if rowData["GCA_GENDER"]:
+        jsonData["GENDER"] = rowData["GCA_GENDER"]
+        updateStat(recordType, "GENDER", rowData["GCA_GENDER"])
+
+    # --map the address
+    fullAddress = ""
+    if rowData["GCA_STREETADDRESS1"]:
+        jsonData["PRIMARY_ADDR_LINE1"] = rowData["GCA_STREETADDRESS1"]
+        fullAddress += " " + rowData["GCA_STREETADDRESS1"]
+    if rowData["GCA_STREETADDRESS2"]:
+        jsonData["PRIMARY_ADDR_LINE2"] = rowData["GCA_STREETADDRESS2"]
+        fullAddress += " " + rowData["GCA_STREETADDRESS2"]
+    if rowData["GCA_CITYNAME"]:
+        jsonData["PRIMARY_ADDR_CITY"] = rowData["GCA_CITYNAME"]
+        fullAddress += " " + rowData["GCA_CITYNAME"]
+    if rowData["GCA_STATEPROVINCECODE"]:
+        jsonData["PRIMARY_ADDR_STATE"] = rowData["GCA_STATEPROVINCECODE"]
+        fullAddress += " " + rowData["GCA_STATEPROVINCECODE"]
+    if rowData["GCA_POSTALCODE"]:
+        jsonData["PRIMARY_ADDR_POSTAL_CODE"] = rowData["GCA_POSTALCODE"]
+        fullAddress += " " + rowData["GCA_POSTALCODE"]
+    if rowData["GCA_COUNTRYCODE"]:
+        jsonData["PRIMARY_ADDR_COUNTRY"] = rowData["GCA_COUNTRYCODE"]
+        fullAddress += " " + rowData["GCA_COUNTRYCODE"]
+    fullAddress = fullAddress.strip()
+    if fullAddress:
+        updateStat(recordType, "ADDRESS-PRIMARY", fullAddress)
+
+    # --phones and email
+    if rowData["PRIMARYPHONE"]:
+        jsonData["PRIMARY_PHONE_NUMBER"] = rowData["PRIMARYPHONE"]
+        updateStat(recordType, "PHONE-PRIMARY", rowData["PRIMARYPHONE"])
+        if rowData["PRIMARYPHONEEXTENSION"]:
+            jsonData["PRIMARY_PHONE_EXT"] = rowData["PRIMARYPHONEEXTENSION"]
+    if rowData["SECONDARYPHONE"]:
+        jsonData["SECONDARY_PHONE_NUMBER"] = rowData["SECONDARYPHONE"]
+        updateStat(recordType, "PHONE-SECONDARY", rowData["SECONDARYPHONE"])
+        if rowData["SECONDARYPHONEEXTENSION"]:
+            jsonData["SECONDARY_PHONE_EXT"] = rowData["SECONDARYPHONEEXTENSION"]
+    if rowData["EMAIL"]:
+        jsonData["EMAIL_ADDRESS"] = rowData["EMAIL"]
+        updateStat(recordType, "EMAIL_ADDRESS", rowData["EMAIL"])
+
+    # --relate them to the company they own and use their group association for matching
+    if rowData["DUNS_ID"]:
+        jsonData["REL_POINTER_DOMAIN"] = "DUNS"
+        jsonData["REL_POINTER_KEY"] = rowData["DUNS_ID"]
+        jsonData["REL_POINTER_ROLE"] = "Contact"
+        jsonData["GROUP_ASSN_ID_TYPE"] = "DUNS"
+        jsonData["GROUP_ASSN_ID_NUMBER"] = rowData["DUNS_ID"]
+        updateStat(recordType, "GROUP_ASSN_ID", rowData["DUNS_ID"])
+    if rowData["GCA_BUSINESSNAME"]:
+        jsonData["GROUP_ASSOCIATION_ORG_NAME"] = rowData["GCA_BUSINESSNAME"]
+        updateStat(recordType, "GROUP_ASSOCIATION_NAME", rowData["GCA_BUSINESSNAME"])
+
+    # --other info
+    if rowData["JOBTITLE"]:
+        jsonData["JOB_TITLE"] = rowData["JOBTITLE"]
+        updateStat(recordType, "JOB_TITLE", rowData["JOBTITLE"])
+
+    return [jsonData]  # --must return a list even though only 1
+
+
+# ----------------------------------------
+def format_UBO(rowData):
+
+    # --gotta filter for this ... sometimes there is no ownership in a company
+    # if not rowData['BENF_TYP_CD']:
+    #    return []
+
+    # --data corrections / updates
+    if (
+        ":" in rowData["SUBJ_DUNS"]
+    ):  # --sometimes they prepended file name to first column like this: UBO_00_0819.txt:021475652
+        rowData["SUBJ_DUNS"] = rowData["SUBJ_DUNS"][rowData["SUBJ_DUNS"].find(":") + 1 :]
+
+    if rowData["BENF_TYP_CD"] == "119":
+        recordType = "PERSON"
+        nameAttribute = "NAME_FULL"
+        addressPrefix = ""
+    else:
+        recordType = "ORGANIZATION"
+        nameAttribute = "NAME_ORG"
+        addressPrefix = "BUSINESS_"
+
+    # --json header
+    jsonData = {}
+    jsonData["DATA_SOURCE"] = "DNB-OWNER"
+    if rowData["BENF_ID"]:
+        jsonData["RECORD_ID"] = "%s-%s" % (rowData["SUBJ_DUNS"], rowData["BENF_ID"])
+    jsonData["RECORD_TYPE"] = recordType
+    updateStat("INPUT", recordType)
+
+    jsonData[nameAttribute] = rowData["BENF_NME"]
+    updateStat(recordType, nameAttribute, rowData["BENF_NME"])
+
+    # --affiliate them to the subject country
+    if rowData["SUBJ_CTRY_CD"]:
+        jsonData["COUNTRY_OF_ASSOCIATION"] = rowData["SUBJ_CTRY_CD"]
+        updateStat(recordType, "COUNTRY_OF_ASSOCIATION", rowData["SUBJ_CTRY_CD"])
+
+    # --address
+    addressData = {}
+    addrFull = ""
+    if rowData["BENF_ADR_LN1"]:
+        addressData[addressPrefix + "ADDR_LINE1"] = rowData["BENF_ADR_LN1"]
+        addrFull += " " + rowData["BENF_ADR_LN1"]
+    if rowData["BENF_ADR_LN2"]:
+        addressData[addressPrefix + "ADDR_LINE2"] = rowData["BENF_ADR_LN2"]
+        addrFull += " " + rowData["BENF_ADR_LN2"]
+    if rowData["BENF_ADR_LN3"]:
+        addressData[addressPrefix + "ADDR_LINE3"] = rowData["BENF_ADR_LN3"]
+        addrFull += " " + rowData["BENF_ADR_LN3"]
+    if rowData["BENF_PRIM_TOWN"]:
+        addressData[addressPrefix + "ADDR_CITY"] = rowData["BENF_PRIM_TOWN"]
+        addrFull += " " + rowData["BENF_PRIM_TOWN"]
+    if rowData["BENF_CNTY"] or rowData["BENF_PROV_OR_ST"]:
+        addressData[addressPrefix + "ADDR_STATE"] = (rowData["BENF_CNTY"] + " " + rowData["BENF_PROV_OR_ST"]).strip()
+        addrFull += " " + (rowData["BENF_CNTY"] + " " + rowData["BENF_PROV_OR_ST"]).strip()
+    if rowData["BENF_POST_CD"]:
+        addressData[addressPrefix + "ADDR_POSTAL_CODE"] = rowData["BENF_POST_CD"]
+        addrFull += " " + rowData["BENF_POST_CD"]
+    if rowData["BENF_CTRY_CD"]:
+        addressData[addressPrefix + "ADDR_COUNTRY"] = rowData["BENF_CTRY_CD"]
+        addrFull += " " + rowData["BENF_CTRY_CD"]
+    if addressData:
+        jsonData.update(addressData)
+        updateStat(recordType, "ADDRESS", addrFull.strip())
+
+    # --these are good identifiers
+    if rowData["BENF_DUNS"]:
+        jsonData["DUNS_NUMBER"] = rowData["BENF_DUNS"]
+        updateStat(recordType, "DUNS_NUMBER")
+    if rowData["BENF_ID"]:
+        jsonData["DNB_OWNER_ID"] = rowData["BENF_ID"]
+        updateStat(recordType, "DNB_OWNER_ID")
+
+    # --these aren't currently populated but maybe one day!
+    if rowData["NATY"]:
+        jsonData["NATIONALITY"] = rowData["NATY"]
+        updateStat(recordType, "NATIONALITY", rowData["NATY"])
+    if rowData["DT_OF_BRTH"]:
+        jsonData["DATE_OF_BIRTH"] = rowData["DT_OF_BRTH"]
+        updateStat(recordType, "DATE_OF_BIRTH", rowData["DT_OF_BRTH"])
+
+    # --relate them to the company they own and use their group association for matching
+    if rowData["SUBJ_DUNS"]:
+        jsonData["REL_POINTER_DOMAIN"] = "DUNS"
+        jsonData["REL_POINTER_KEY"] = rowData["SUBJ_DUNS"]
+        jsonData["REL_POINTER_ROLE"] = "Owner"
+        jsonData["GROUP_ASSN_ID_TYPE"] = "DUNS"
+        jsonData["GROUP_ASSN_ID_NUMBER"] = rowData["SUBJ_DUNS"]
+        updateStat(recordType, "GROUP_ASSN_ID", rowData["SUBJ_DUNS"])
+    if rowData["SUBJ_NME"]:
+        jsonData["GROUP_ASSOCIATION_ORG_NAME"] = rowData["SUBJ_NME"]
+        updateStat(recordType, "GROUP_ASSOCIATION_NAME", rowData["SUBJ_NME"])
+
+    # --additional useful information
+    if rowData["BENF_LGL_FORM_DESC"]:
+        jsonData["LEGAL_FORM"] = rowData["BENF_LGL_FORM_DESC"]
+        updateStat(recordType, "LEGAL_FORM", rowData["BENF_LGL_FORM_DESC"])
+    if rowData["DIRC_OWRP_PCTG"]:
+        jsonData["DIRECT_OWNERSHIP_PERCENT"] = float(rowData["DIRC_OWRP_PCTG"])
+        updateStat(recordType, "DIRECT_OWNERSHIP_PERCENT", rowData["DIRC_OWRP_PCTG"])
+        jsonData["REL_POINTER_ROLE"] += " %sD" % rowData["DIRC_OWRP_PCTG"]
+    if rowData["IDIR_OWRP_PCTG"]:
+        jsonData["INDIRECT_OWNERSHIP_PERCENT"] = float(rowData["IDIR_OWRP_PCTG"])
+        jsonData["REL_POINTER_ROLE"] += " %sI" % rowData["IDIR_OWRP_PCTG"]
+        updateStat(recordType, "INDIRECT_OWNERSHIP_PERCENT", rowData["IDIR_OWRP_PCTG"])
+    if rowData["BENF_OWRP_PCTG"]:
+        jsonData["BENEFICIAL_OWNERSHIP_PERCENT"] = float(rowData["BENF_OWRP_PCTG"])
+        jsonData["REL_POINTER_ROLE"] += " %sB" % rowData["BENF_OWRP_PCTG"]
+        updateStat(recordType, "BENEFICIAL_OWNERSHIP_PERCENT", rowData["BENF_OWRP_PCTG"])
+
+    return [jsonData]  # --must return a list even though only 1
+
+
+# ----------------------------------------
+@pytest.mark.parametrize("dnbFormat, referenceMapper", [("GCA", format_GCA), ("UBO", format_UBO)])
+@pytest.mark.parametrize("statsLevel", ["full", "off"])
+def test_record_map_matches_hand_written_mapper(dnbFormat, referenceMapper, statsLevel, generatedFile, monkeypatch):
+    dnb_benchmark.setUpMapper(dnbFormat, "json")
+    monkeypatch.setattr(dnb_mapper, "statsLevel", statsLevel)
+    with contextlib.redirect_stdout(None):
+        rowList = dnb_benchmark.readRows(dnbFormat, generatedFile(dnbFormat, 500))
+    assert dnb_mapper.recordMapper is not None
+    # --the first column sometimes has the file name in front of it
+    rowList.append(["UBO_00_0819.txt:" + rowList[0][0]] + rowList[0][1:])
+
+    mappedStats = []
+    monkeypatch.setattr(
+        dnb_mapper, "updateStat", lambda cat1, cat2, example=None: mappedStats.append((cat1, cat2, example))
+    )
+    referenceStats.clear()
+    for row in rowList:
+        rowData = dict(zip(dnb_mapper.schemaData["columnNames"], row))
+        assert dnb_mapper.recordMapper(row) == referenceMapper(rowData)
+    assert mappedStats == (referenceStats if statsLevel == "full" else [])
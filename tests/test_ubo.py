@@ -0,0 +1,99 @@
+import json
+import random
+
+from conftest import readJsonLines, runMapper
+
+
+# ----------------------------------------
+def shuffleRows(inputFileName, outputFileName, seed=1):
+    """the same rows with the header kept first and the rest in a random order"""
+    with open(inputFileName, "r", encoding="latin1") as inputFileHandle:
+        headerRow = inputFileHandle.readline()
+        inputRows = inputFileHandle.readlines()
+    random.Random(seed).shuffle(inputRows)
+    with open(outputFileName, "w", encoding="latin1") as outputFileHandle:
+        outputFileHandle.write(headerRow)
+        outputFileHandle.writelines(inputRows)
+    return outputFileName
+
+
+# ----------------------------------------
+def normalizeRecords(jsonLines):
+    """the records with their relationships in a set order, owners at one depth point to those above
+    them in the order their rows arrived"""
+    recordList = []
+    for jsonLine in jsonLines:
+        jsonData = json.loads(jsonLine)
+        if "RELATIONSHIPS" in jsonData:
+            jsonData["RELATIONSHIPS"].sort(key=json.dumps)
+        recordList.append(json.dumps(jsonData, sort_keys=True))
+    return sorted(recordList)
+
+
+# ----------------------------------------
+def test_ubo_streaming_stops_on_ungrouped_subjects(tmp_path, generatedFile):
+    """a subject that turns up again after its chart was dropped stops the run rather than mislinking owners"""
+    shuffledFile = shuffleRows(generatedFile("UBO", 400), str(tmp_path / "ubo_shuffled.txt"))
+    fullRun = runMapper("-f", "UBO_ALONE", "-i", shuffledFile, "-o", tmp_path / "full.json")
+    assert fullRun.returncode == 0, fullRun.stderr
+    streamingRun = runMapper(
+        "-f", "UBO_ALONE", "-i", shuffledFile, "-o", tmp_path / "streaming.json", "--ubo_streaming"
+    )
+    assert streamingRun.returncode == 0, streamingRun.stderr
+    assert "--ubo_sort" in streamingRun.stdout
+    assert "aborted" in streamingRun.stdout
+
+    # --everything written before it stopped is just as the run that kept every chart wrote it
+    streamingRecords = readJsonLines(str(tmp_path / "streaming.json"))
+    assert streamingRecords
+    assert set(streamingRecords) <= set(readJsonLines(str(tmp_path / "full.json")))
+
+
+# ----------------------------------------
+def test_ubo_sort_maps_ungrouped_rows_like_grouped_ones(tmp_path, generatedFile):
+    groupedFile = generatedFile("UBO", 400)
+    shuffledFile = shuffleRows(groupedFile, str(tmp_path / "ubo_shuffled.txt"))
+    groupedRun = runMapper("-f", "UBO_ALONE", "-i", groupedFile, "-o", tmp_path / "grouped.json", "--ubo_streaming")
+    assert groupedRun.returncode == 0, groupedRun.stderr
+    assert "aborted" not in groupedRun.stdout
+    sortedRun = runMapper("-f", "UBO_ALONE", "-i", shuffledFile, "-o", tmp_path / "sorted.json", "--ubo_sort")
+    assert sortedRun.returncode == 0, sortedRun.stderr
+    sortedRecords = normalizeRecords(readJsonLines(str(tmp_path / "sorted.json")))
+    assert sortedRecords == normalizeRecords(readJsonLines(str(tmp_path / "grouped.json")))
+
+
+# ----------------------------------------
+def test_ubo_cache_file_only_saved_by_finished_runs(tmp_path, generatedFile):
+    """a run that stops early must not mark its subjects as written for the next run"""
+    groupedFile = generatedFile("UBO", 400)
+    shuffledFile = shuffleRows(groupedFile, str(tmp_path / "ubo_shuffled.txt"))
+    cacheFile = tmp_path / "ubo_cache.bin"
+    abortedRun = runMapper(
+        "-f",
+        "UBO_ALONE",
+        "-i",
+        shuffledFile,
+        "-o",
+        tmp_path / "aborted.json",
+        "--ubo_streaming",
+        "--ubo_cache_file",
+        cacheFile,
+    )
+    assert abortedRun.returncode == 0, abortedRun.stderr
+    assert "aborted" in abortedRun.stdout
+    assert not cacheFile.exists()
+
+    # --a finished run saves them, so the next run writes none of its subjects again
+    firstRun = runMapper(
+        "-f", "UBO_ALONE", "-i", groupedFile, "-o", tmp_path / "first.json", "--ubo_cache_file", cacheFile
+    )
+    assert firstRun.returncode == 0, firstRun.stderr
+    assert cacheFile.exists()
+    firstRecords = [json.loads(x) for x in readJsonLines(str(tmp_path / "first.json"))]
+    assert any(x["DATA_SOURCE"] == "DNB-COMPANY" for x in firstRecords)
+    secondRun = runMapper(
+        "-f", "UBO_ALONE", "-i", groupedFile, "-o", tmp_path / "second.json", "--ubo_cache_file", cacheFile
+    )
+    assert secondRun.returncode == 0, secondRun.stderr
+    secondRecords = [json.loads(x) for x in readJsonLines(str(tmp_path / "second.json"))]
+    assert not any(x["DATA_SOURCE"] == "DNB-COMPANY" for x in secondRecords)